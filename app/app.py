@@ -13,25 +13,42 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 load_dotenv()
 
 # Import custom modules
-from utils.file_utils import extract_text_from_file
-from utils.llm_utils import generate_initial_prd, generate_interactive_prd_update, generate_change_summary
+from utils.file_utils import FileTooLargeError, extract_text_cached, save_session_mrd
+from utils.llm_cache import get_llm_cache
 from utils.database import PRDDatabase
 from utils.diff_utils import generate_side_by_side_diff, get_change_stats
+from utils.jobs import JobManager, JobAlreadyRunning
+from utils.telemetry import start_telemetry
 from components.layout import (
     setup_page_config, load_custom_css, render_sidebar_sessions, 
-    render_sidebar_download, render_sidebar_version_history, render_rollback_modal,
+    render_sidebar_download, render_sidebar_version_history, render_rollback_modal, render_sidebar_search,
     render_main_layout, render_initial_setup_form, render_chat_interface,
     render_chat_input, render_historical_version_view, render_prd_preview_section,
-    render_version_navigation, render_prd_content_container, render_quick_actions
+    render_version_navigation, render_prd_content_container, render_quick_actions,
+    render_prd_skeleton_loading, render_prd_preview_content, render_sidebar_cache_toggle,
+    render_cancel_generation_button
 )
 
 # Initialize database
 @st.cache_resource
 def init_database():
-    return PRDDatabase()
+    return PRDDatabase(
+        storage_mode=os.environ.get("PRD_STORAGE_MODE", "full"),
+        keyframe_interval=int(os.environ.get("PRD_KEYFRAME_INTERVAL", "10"))
+    )
 
 db = init_database()
 
+# LLM call telemetry for the admin page, written in the background
+start_telemetry(db)
+
+# Background generation jobs - one worker pool per server process
+@st.cache_resource
+def init_job_manager():
+    return JobManager(db, max_workers=int(os.environ.get("JOB_WORKERS", "8")))
+
+jobs = init_job_manager()
+
 # Page configuration
 setup_page_config()
 
@@ -44,8 +61,12 @@ if 'show_toast' in st.session_state:
         st.toast("Initial PRD generated successfully!", icon="🚀")
     elif st.session_state.show_toast == "prd_updated":
         st.toast("PRD updated successfully!", icon="🎉")
+    elif st.session_state.show_toast == "prd_cancelled":
+        st.toast("Generation cancelled", icon="⏹️")
     elif st.session_state.show_toast == "prd_error":
-        st.toast("Error updating PRD!", icon="🚨")
+        st.toast(st.session_state.pop('prd_error_message', None) or "Error updating PRD!", icon="🚨")
+    elif st.session_state.show_toast == "job_running":
+        st.toast("A job is already running - wait for it to finish or cancel it", icon="⏳")
     elif st.session_state.show_toast == "rollback_success":
         st.toast("Rollback completed successfully!", icon="✅")
     
@@ -71,6 +92,8 @@ if 'show_diff' not in st.session_state:
     st.session_state.show_diff = True
 if 'is_loading' not in st.session_state:
     st.session_state.is_loading = False
+if 'use_llm_cache' not in st.session_state:
+    st.session_state.use_llm_cache = os.environ.get("LLM_CACHE_ENABLED", "false").lower() == "true"
 
 # Clean up any lingering rollback target from previous sessions/refreshes
 if hasattr(st.session_state, 'rollback_target') and 'rollback_target' in st.session_state:
@@ -87,6 +110,9 @@ def create_new_session():
     st.session_state.current_version = 1
     st.session_state.viewing_version = 1
     st.session_state.show_diff = True
+    # A running job keeps going and saves into its own session
+    st.session_state.is_loading = False
+    st.session_state.pop('active_job_id', None)
     
     # Mark that session was just created to trigger auto-scroll
     st.session_state.session_just_loaded = True
@@ -107,9 +133,31 @@ def load_session(session_id: str, product_name: str):
     
     st.session_state.show_diff = False
     
+    # Resume polling a generation that is still running for this session
+    active_job = db.get_active_job(session_id)
+    if active_job:
+        st.session_state.active_job_id = active_job['id']
+        st.session_state.is_loading = True
+        if active_job['kind'] == "initial_prd":
+            st.session_state.initialized = False
+        else:
+            st.session_state.messages.append({"role": "user", "content": active_job['params']['user_request']})
+    else:
+        st.session_state.pop('active_job_id', None)
+        st.session_state.is_loading = False
+    
     # Mark that session was just loaded to trigger auto-scroll
     st.session_state.session_just_loaded = True
 
+def open_search_result(session_id: str, product_name: str, version_number: int = None):
+    """Open the session of a search hit, jumping to the matching version"""
+    if session_id != st.session_state.session_id or not st.session_state.initialized:
+        load_session(session_id, product_name)
+    
+    if version_number and version_number != st.session_state.current_version:
+        st.session_state.viewing_version = version_number
+        st.session_state.show_diff = False
+
 def download_prd():
     """Generate download for current PRD"""
     if st.session_state.current_prd:
@@ -139,6 +187,68 @@ def get_version_content(version_number: int) -> str:
         version_data = db.get_version_by_number(st.session_state.session_id, version_number)
         return version_data['content'] if version_data else ""
 
+def start_job(kind: str, params: dict) -> bool:
+    """Hand a generation to the background workers; the page polls it until it finishes.
+
+    Returns False if the session already has a job running - the request is dropped
+    with a toast and the page follows the running job instead.
+    """
+    params = dict(params, use_cache=st.session_state.use_llm_cache)
+    try:
+        st.session_state.active_job_id = jobs.submit(st.session_state.session_id, kind, params)
+    except JobAlreadyRunning as e:
+        st.session_state.active_job_id = e.job_id
+        st.session_state.show_toast = "job_running"
+        st.session_state.is_loading = True
+        return False
+    st.session_state.is_loading = True
+    return True
+
+def cancel_active_job():
+    """Stop the running generation; the next sync rolls the page back to before the request"""
+    job_id = st.session_state.get('active_job_id')
+    if job_id:
+        # If the job saved its result just before, cancel() fails and the result is shown instead
+        jobs.cancel(job_id)
+    st.rerun()
+
+def sync_active_job():
+    """Pick up the result of the session's background job; returns the job while it is still running"""
+    job_id = st.session_state.get('active_job_id')
+    if not job_id:
+        return None
+    
+    job = jobs.get_job(job_id)
+    if job and job['status'] in ("queued", "running"):
+        return job
+    
+    st.session_state.pop('active_job_id', None)
+    st.session_state.is_loading = False
+    if job is None:
+        return None
+    
+    session_id = st.session_state.session_id
+    if job['status'] == "done":
+        latest_version = db.get_latest_version(session_id)
+        st.session_state.current_prd = latest_version['content']
+        st.session_state.current_version = latest_version['version_number']
+        st.session_state.viewing_version = latest_version['version_number']
+        st.session_state.initialized = True
+        st.session_state.show_toast = "initial_prd" if job['kind'] == "initial_prd" else "prd_updated"
+    elif job['status'] == "cancelled":
+        # Nothing was saved - the reload below drops the pending user message
+        st.session_state.show_toast = "prd_cancelled"
+    else:
+        st.session_state.prd_error_message = job['error']
+        st.session_state.show_toast = "prd_error"
+    
+    # The worker saved the turn - the database has the authoritative chat history
+    st.session_state.messages = db.get_chat_history(session_id)
+    
+    # Vyčistíme dočasné hodnoty
+    st.session_state.pop('temp_additional_context', None)
+    st.rerun()
+
 def render_chat_panel(db):
     """Render the chat panel - can be used anywhere on the page"""
     # Simple sticky wrapper
@@ -146,134 +256,46 @@ def render_chat_panel(db):
     
     st.header("💬 Interactive PRD Chat")
     
-    # ========== ZPRACOVÁNÍ LOADING STAVŮ NA ZAČÁTKU ==========
-    # Zpracování počátečního PRD generování
-    if st.session_state.is_loading and not st.session_state.initialized:
-        # Extract MRD content if provided from session state
-        mrd_content = st.session_state.get('temp_mrd_content', "")
-        additional_context = st.session_state.get('temp_additional_context', "")
-        
-        # Generate initial PRD
-        with st.spinner("🤖 AI is generating initial PRD..."):
-            initial_prd = generate_initial_prd(mrd_content, st.session_state.product_name, additional_context)
-            st.session_state.current_prd = initial_prd
-            st.session_state.initialized = True
-            st.session_state.current_version = 1
-            st.session_state.viewing_version = 1
-            
-            # Save to database
-            initial_prompt = f"Product: {st.session_state.product_name}"
-            if mrd_content:
-                initial_prompt += f"\nMRD Content: {mrd_content[:200]}..."
-            if additional_context:
-                initial_prompt += f"\nAdditional Context: {additional_context}"
-            
-            db.save_version(
-                st.session_state.session_id,
-                initial_prd,
-                "Initial PRD",
-                "Generated initial PRD from MRD and context",
-                initial_prompt
-            )
-            
-            # Add to chat history
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": f"I've generated an initial PRD for '{st.session_state.product_name}'. You can see it in the preview panel. How would you like to modify it?"
-            })
-            
-            db.save_chat_message(st.session_state.session_id, "assistant", st.session_state.messages[-1]["content"])
-            
-            # Vyčistíme dočasné hodnoty
-            if 'temp_mrd_content' in st.session_state:
-                del st.session_state.temp_mrd_content
-            if 'temp_additional_context' in st.session_state:
-                del st.session_state.temp_additional_context
-            
-            # Set toast to show after rerun
-            st.session_state.show_toast = "initial_prd"
-        
-        st.session_state.is_loading = False
-        st.rerun()
-    
-    # Zpracování update PRD z chat zpráv
-    if st.session_state.is_loading and st.session_state.initialized and st.session_state.messages:
-        last_message = st.session_state.messages[-1]
-        last_role = last_message.get("role") or last_message.get("type", "assistant")
-        
-        if last_role == "user":
-            user_request = last_message.get("content", "")
-            
-            # Generate updated PRD
-            old_prd = st.session_state.current_prd
-            
-            with st.spinner("🤖 AI is generating updated PRD..."):
-                updated_prd = generate_interactive_prd_update(
-                    st.session_state.current_prd,
-                    user_request,
-                    st.session_state.product_name
-                )
-            
-            if updated_prd and not updated_prd.startswith("Error"):
-                st.session_state.current_prd = updated_prd
-                st.session_state.current_version += 1
-                st.session_state.viewing_version = st.session_state.current_version
-                
-                # Generate change summary
-                change_summary = generate_change_summary(old_prd, updated_prd)
-                
-                # Save new version
-                db.save_version(
-                    st.session_state.session_id,
-                    updated_prd,
-                    "User Request Update",
-                    change_summary,
-                    user_request
-                )
-                
-                # Add assistant response
-                assistant_message = f"I've updated the PRD based on your request. Changes: {change_summary}"
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": assistant_message
-                })
-                db.save_chat_message(st.session_state.session_id, "assistant", assistant_message)
-                
-                # Set toast to show after rerun
-                st.session_state.show_toast = "prd_updated"
-            else:
-                assistant_message = f"Sorry, I encountered an error: {updated_prd}"
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": assistant_message
-                })
-                db.save_chat_message(st.session_state.session_id, "assistant", assistant_message)
-                st.session_state.show_toast = "prd_error"
-            
-            st.session_state.is_loading = False
-            st.rerun()
-    
     # ========== NORMÁLNÍ UI LOGIKA ==========
     
+    # Initial PRD is being generated in the background
+    if not st.session_state.initialized and st.session_state.is_loading:
+        st.write(f"**Product:** {st.session_state.product_name}")
+        st.info("🤖 AI is generating your initial PRD...")
+    
     # Initial setup if not initialized
-    if not st.session_state.initialized:
+    elif not st.session_state.initialized:
         product_name, mrd_file, additional_context = render_initial_setup_form()
         
         if st.button("🎯 Generate Initial PRD", use_container_width=True):
             if product_name:
                 # Uložíme všechna data z formuláře do session state
                 st.session_state.product_name = product_name
-                st.session_state.temp_mrd_content = ""
                 st.session_state.temp_additional_context = additional_context or ""
                 
-                # Extract MRD content if provided
+                # Extract MRD content if provided - a file uploaded before comes from the cache
+                mrd_sha256, mrd_content = None, ""
                 if mrd_file:
-                    st.session_state.temp_mrd_content = extract_text_from_file(mrd_file)
-                
-                st.session_state.is_loading = True
+                    try:
+                        mrd_sha256, mrd_content = extract_text_cached(db, mrd_file)
+                    except FileTooLargeError as e:
+                        st.error(f"Cannot use this MRD: {e}")
+                        st.stop()
                 
                 # Create session in database
                 db.create_session(st.session_state.session_id, product_name)
+                if mrd_sha256:
+                    # The job reads the MRD from the session's document instead of a copy in its params
+                    save_session_mrd(db, st.session_state.session_id, mrd_sha256, mrd_content,
+                                     mrd_file.name, mrd_file.size)
+                
+                start_job("initial_prd", {
+                    "product_name": product_name,
+                    "mrd_content": None if mrd_sha256 else mrd_content,
+                    "additional_context": st.session_state.temp_additional_context,
+                    "mode": os.environ.get("PRD_INITIAL_GENERATION", "stream"),
+                    "section_workers": int(os.environ.get("PRD_SECTION_WORKERS", "4"))
+                })
                 
                 # Ihned rerun, aby se zobrazil skeleton loading
                 st.rerun()
@@ -296,6 +318,9 @@ def render_chat_panel(db):
                 should_auto_scroll = True
             render_chat_interface(st.session_state.messages, auto_scroll=should_auto_scroll)
             
+            if st.session_state.is_loading:
+                st.info("🤖 AI is generating updated PRD...")
+            
             # Quick Actions before chat input
             if not st.session_state.is_loading:
                 selected_action = render_quick_actions()
@@ -312,11 +337,11 @@ def render_chat_panel(db):
                     
                     if selected_action in action_prompts:
                         user_input = action_prompts[selected_action]
-                        st.session_state.messages.append({"role": "user", "content": user_input})
-                        db.save_chat_message(st.session_state.session_id, "user", user_input)
                         # Increment counter to create new input widget
                         st.session_state.input_counter = st.session_state.get('input_counter', 0) + 1
-                        st.session_state.is_loading = True
+                        if start_job("prd_update", {"user_request": user_input, "product_name": st.session_state.product_name}):
+                            # Persisted together with the resulting version by the update job
+                            st.session_state.messages.append({"role": "user", "content": user_input})
                         st.rerun()
             
             # Chat input for current version
@@ -324,10 +349,10 @@ def render_chat_panel(db):
             
             # Handle chat input submission
             if user_input and not st.session_state.is_loading:
-                # Add user message
-                st.session_state.messages.append({"role": "user", "content": user_input})
-                db.save_chat_message(st.session_state.session_id, "user", user_input)
-                st.session_state.is_loading = True
+                if start_job("prd_update", {"user_request": user_input, "product_name": st.session_state.product_name}):
+                    # Add user message
+                    # Persisted together with the resulting version by the update job
+                    st.session_state.messages.append({"role": "user", "content": user_input})
                 st.rerun()
             
             # Clear messages button
@@ -435,22 +460,29 @@ def render_chat_panel(db):
     st.markdown('</div>', unsafe_allow_html=True)
 
 
-def render_prd_panel(db):
+def render_prd_preview_partial(active_job, message: str):
+    """Show the output generated so far by the running job, or the skeleton until the first tokens"""
+    partial_output = active_job.get('partial_output') if active_job else None
+    render_cancel_generation_button(cancel_active_job)
+    if partial_output:
+        render_prd_preview_content(partial_output, loading=False)
+    else:
+        render_prd_skeleton_loading(message)
+
+def render_prd_panel(db, versions, active_job=None):
     """Render the PRD preview panel with loading overlay and version navigation"""
     render_prd_preview_section()
 
     # Pokud ještě není inicializováno
     if not st.session_state.initialized:
-        # Pokud generujeme počáteční PRD, zobrazíme skeleton
+        # Pokud generujeme počáteční PRD, zobrazíme skeleton do prvního tokenu
         if st.session_state.is_loading:
-            from components.layout import render_prd_skeleton_loading
-            render_prd_skeleton_loading("🤖 AI is generating your initial PRD...")
+            render_prd_preview_partial(active_job, "🤖 AI is generating your initial PRD...")
         else:
             st.info("👈 Start by creating an initial PRD in the chat panel")
         return
 
     # Navigace mezi verzemi
-    versions = db.get_versions(st.session_state.session_id)
     if versions:
         render_version_navigation(versions)
 
@@ -465,9 +497,8 @@ def render_prd_panel(db):
             st.session_state.is_loading
             and st.session_state.viewing_version == st.session_state.current_version
         ):
-            from components.layout import render_prd_skeleton_loading
-            # Použijeme skeleton loading místo obyčejného overlay
-            render_prd_skeleton_loading("🤖 AI is updating your PRD...")
+            # Skeleton loading do prvního tokenu, pak streamovaný text
+            render_prd_preview_partial(active_job, "🤖 AI is updating your PRD...")
             return
 
         # === DIFF VIEW ===
@@ -489,17 +520,23 @@ def render_prd_panel(db):
                 )
         else:
             # === NORMÁLNÍ VIEW ===
-            from components.layout import render_prd_preview_content
             render_prd_preview_content(current_content, loading=False)
 
 
 
-# Sidebar for session management and history
+# Apply a finished background job before anything is rendered
+active_job = sync_active_job()
+
+# Version metadata for the sidebar and navigation - loaded once per rerun, content is fetched on demand
+versions = db.list_versions(st.session_state.session_id) if st.session_state.initialized else []
+
 # Sidebar for session management and history
 with st.sidebar:
     # Load all sessions
     all_sessions = db.get_all_sessions()
     
+    render_sidebar_search(db, open_search_result)
+    
     render_sidebar_sessions(db, all_sessions, create_new_session, load_session)
     
     st.divider()
@@ -507,11 +544,11 @@ with st.sidebar:
     # Download PRD section
     render_sidebar_download(download_prd)
     
+    render_sidebar_cache_toggle(get_llm_cache().stats())
+    
     # Version History
-    if st.session_state.initialized:
-        versions = db.get_versions(st.session_state.session_id)
-        if versions:
-            render_sidebar_version_history(db, versions)
+    if st.session_state.initialized and versions:
+        render_sidebar_version_history(db, versions)
 
 # Global cleanup for rollback modal - clear if user navigated away
 if hasattr(st.session_state, 'rollback_target') and st.session_state.rollback_target is not None:
@@ -532,7 +569,7 @@ render_rollback_modal(db)
 col1, col2 = render_main_layout()
 
 with col1:
-    render_prd_panel(db)
+    render_prd_panel(db, versions, active_job)
 
 with col2:
     render_chat_panel(db)
@@ -540,3 +577,8 @@ with col2:
 # Footer
 st.markdown("---")
 st.markdown("**AI PRD Generator v2.0** - Interactive chat with version control and diff viewing")
+
+# Poll the running job - the generation itself runs in a worker thread, not in this script
+if st.session_state.get('active_job_id'):
+    time.sleep(float(os.environ.get("JOB_POLL_INTERVAL", "0.5")))
+    st.rerun()
@@ -0,0 +1,290 @@
+"""
+Generate PRDs for a whole directory of MRD files without the Streamlit UI.
+
+Every .txt, .pdf and .docx file becomes a new session with its initial PRD,
+named after the file. Text extraction and generation run on bounded worker
+pools. Progress is written after each file, so an interrupted run can simply
+be started again: finished files are skipped unless they changed.
+
+Usage:
+    python -m app.batch MRD_DIR [--db prd_history.db] [--workers 4] [--extract-workers 4]
+        [--context "..."] [--recursive] [--retry-failed] [--use-cache]
+        [--progress MRD_DIR/.prd_batch_progress.json] [--report batch_report.json]
+"""
+
+import argparse
+import io
+import json
+import mimetypes
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from .utils.database import PRDDatabase
+from .utils.file_utils import extract_text_cached, save_session_mrd
+from .utils.llm_scheduler import LLMError
+from .utils.jobs import prepare_mrd_prompt
+from .utils.llm_utils import generate_initial_prd
+from .utils.telemetry import llm_session, start_telemetry
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+
+
+class LocalFile(io.FileIO):
+    """A file from disk with the name/type attributes of a Streamlit upload, for extract_text_from_file.
+
+    It is read lazily; path lets the PDF extractor open it directly instead of spooling a copy.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "rb")
+        self.path = path
+        self.name = os.path.basename(path)
+        self.type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def find_mrd_files(directory: str, recursive: bool = False) -> List[str]:
+    """Supported files in the directory as paths relative to it, in a stable order"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".")) if recursive else []
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith("."):
+                found.append(os.path.relpath(os.path.join(root, name), directory))
+    return found
+
+
+def fingerprint(path: str) -> str:
+    """Cheap change detection for resuming: size and modification time"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def product_name_for(relative_path: str) -> str:
+    stem = os.path.splitext(os.path.basename(relative_path))[0]
+    return " ".join(stem.replace("_", " ").replace("-", " ").split()) or stem
+
+
+class Progress:
+    """Per-file results persisted as JSON after every update"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+
+    def is_done(self, relative_path: str, file_fingerprint: str) -> bool:
+        entry = self.entries.get(relative_path)
+        return bool(entry) and entry["status"] == "done" and entry.get("fingerprint") == file_fingerprint
+
+    def update(self, relative_path: str, **entry):
+        with self._lock:
+            self.entries[relative_path] = entry
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.entries}, f, indent=2, ensure_ascii=False)
+            # Atomic replace - an interrupted run never leaves a truncated progress file
+            os.replace(tmp_path, self.path)
+
+
+def write_report(args, directory: str, started_at: datetime, results: List[Dict], skipped: int,
+                 elapsed: float, interrupted: bool = False) -> Dict:
+    """Write the JSON report of a run to args.report and return its stats.
+
+    An interrupted run is reported too, with the files it finished.
+    """
+    done = [r for r in results if r["status"] == "done"]
+    failed = [r for r in results if r["status"] != "done"]
+    stats = {
+        "files": len(results),
+        "succeeded": len(done),
+        "failed": len(failed),
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed, 2),
+        "files_per_minute": round(len(results) / elapsed * 60, 2) if elapsed else 0.0,
+        "avg_extract_seconds": (
+            round(sum(r.get("extract_seconds", 0) for r in results) / len(results), 3) if results else 0.0
+        ),
+        "avg_generate_seconds": round(sum(r["generate_seconds"] for r in done) / len(done), 3) if done else 0.0,
+        "mrd_chars": sum(r["mrd_chars"] for r in done),
+        "prd_chars": sum(r["prd_chars"] for r in done),
+    }
+    report = {
+        "directory": directory,
+        "database": os.path.abspath(args.db),
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "workers": args.workers,
+        "extract_workers": args.extract_workers,
+        "interrupted": interrupted,
+        "stats": stats,
+        "results": sorted(results, key=lambda r: r["file"]),
+    }
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return stats
+
+
+def run_batch(args) -> int:
+    directory = os.path.abspath(args.directory)
+    progress = Progress(args.progress or os.path.join(directory, ".prd_batch_progress.json"))
+    files = find_mrd_files(directory, args.recursive)
+
+    pending = []
+    skipped = 0
+    for relative_path in files:
+        entry = progress.entries.get(relative_path, {})
+        if progress.is_done(relative_path, fingerprint(os.path.join(directory, relative_path))):
+            skipped += 1
+        elif entry.get("status") == "failed" and not args.retry_failed:
+            skipped += 1
+        else:
+            pending.append(relative_path)
+
+    print(f"📂 {len(files)} MRD files found, {skipped} already processed, {len(pending)} to do")
+    if not pending:
+        # Still replace the report, so it never describes an earlier run
+        write_report(args, directory, datetime.now(), [], skipped, 0.0)
+        print(f"📝 Report written to {args.report}")
+        return 0
+
+    db = PRDDatabase(args.db, pool_size=max(2, args.workers))
+    telemetry = start_telemetry(db)
+    results = []
+    results_lock = threading.Lock()
+    started_at = datetime.now()
+    started = time.perf_counter()
+
+    def extract(relative_path: str) -> Dict:
+        path = os.path.join(directory, relative_path)
+        t0 = time.perf_counter()
+        with LocalFile(path) as file:
+            sha256, text = extract_text_cached(db, file)
+        # raw_text is what the extraction cache holds under sha256
+        return {"text": text.strip(), "raw_text": text, "sha256": sha256, "fingerprint": fingerprint(path),
+                "extract_seconds": time.perf_counter() - t0}
+
+    def generate(relative_path: str, extracted: Dict) -> Dict:
+        product_name = product_name_for(relative_path)
+        session_id = str(uuid.uuid4())
+        t0 = time.perf_counter()
+        with llm_session(session_id):
+            # Same prompt budget as the app - an oversized MRD is condensed or trimmed first
+            index, mrd_prompt, _ = prepare_mrd_prompt(extracted["text"], product_name)
+            prd = generate_initial_prd(mrd_prompt, product_name, args.context, use_cache=args.use_cache)
+        generate_seconds = time.perf_counter() - t0
+
+        db.create_session(session_id, product_name)
+        if extracted["sha256"]:
+            save_session_mrd(db, session_id, extracted["sha256"], extracted["raw_text"], os.path.basename(relative_path),
+                             os.path.getsize(os.path.join(directory, relative_path)))
+        db.save_mrd_chunks(session_id, index.chunks)
+        db.save_version(
+            session_id,
+            prd,
+            "Initial PRD",
+            f"Generated initial PRD from {relative_path} (batch)",
+            f"Product: {product_name}\nMRD Content: {extracted['text'][:200]}...",
+            assistant_message=f"I've generated an initial PRD for '{product_name}' from {relative_path}. How would you like to modify it?"
+        )
+        return {"session_id": session_id, "product_name": product_name, "generate_seconds": round(generate_seconds, 3),
+                "mrd_chars": len(extracted["text"]), "prd_chars": len(prd)}
+
+    def finish(relative_path: str, **entry):
+        entry["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        progress.update(relative_path, **entry)
+        with results_lock:
+            results.append(dict(entry, file=relative_path))
+            icon = "✅" if entry["status"] == "done" else "❌"
+            detail = entry.get("product_name") or entry.get("error")
+            print(f"{icon} [{len(results)}/{len(pending)}] {relative_path}: {detail}")
+
+    def generate_and_record(relative_path: str, extracted: Dict):
+        """Runs on the generation pool; records the outcome itself so that work finished during an interrupt is kept"""
+        common = {"fingerprint": extracted["fingerprint"], "extract_seconds": round(extracted["extract_seconds"], 3)}
+        try:
+            result = generate(relative_path, extracted)
+        except LLMError as e:
+            finish(relative_path, status="failed", stage="generate", error=f"{e.kind}: {e}", **common)
+        except Exception as e:
+            finish(relative_path, status="failed", stage="generate", error=str(e), **common)
+        else:
+            finish(relative_path, status="done", **common, **result)
+
+    extract_pool = ThreadPoolExecutor(max_workers=args.extract_workers)
+    generate_pool = ThreadPoolExecutor(max_workers=args.workers)
+    interrupted = False
+    try:
+        # Each file is handed to the generation pool as soon as its text is extracted
+        extractions = {extract_pool.submit(extract, path): path for path in pending}
+        generations = []
+        for future in as_completed(extractions):
+            relative_path = extractions[future]
+            try:
+                extracted = future.result()
+            except Exception as e:
+                finish(relative_path, status="failed", stage="extract", error=str(e))
+                continue
+            if not extracted["text"]:
+                finish(relative_path, status="failed", stage="extract", error="No text could be extracted",
+                       fingerprint=extracted["fingerprint"])
+                continue
+            generations.append(generate_pool.submit(generate_and_record, relative_path, extracted))
+
+        for future in as_completed(generations):
+            future.result()
+    except KeyboardInterrupt:
+        print("\n⏹️  Interrupted - waiting for running generations, run the same command again to resume")
+        interrupted = True
+        extract_pool.shutdown(wait=False, cancel_futures=True)
+        generate_pool.shutdown(wait=False, cancel_futures=True)
+    finally:
+        extract_pool.shutdown(wait=True)
+        generate_pool.shutdown(wait=True)
+        if telemetry:
+            telemetry.flush()
+        db.close()
+
+    # After the pools shut down no worker appends to results any more
+    stats = write_report(args, directory, started_at, results, skipped, time.perf_counter() - started, interrupted)
+    if interrupted:
+        print(f"📝 Partial report ({stats['files']} files finished) written to {args.report}")
+        return 130
+    print(f"\n📊 {stats['succeeded']} PRDs generated, {stats['failed']} failed in {stats['elapsed_seconds']} s "
+          f"({stats['files_per_minute']} files/min, avg generation {stats['avg_generate_seconds']} s)")
+    print(f"📝 Report written to {args.report}")
+    return 1 if stats["failed"] else 0
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="python -m app.batch", description="Generate PRDs from a directory of MRD files")
+    parser.add_argument("directory", help="Directory with .txt, .pdf and .docx MRD files")
+    parser.add_argument("--db", default="prd_history.db", help="Path to the SQLite database")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent PRD generations")
+    parser.add_argument("--extract-workers", type=int, default=4, help="Concurrent text extractions")
+    parser.add_argument("--context", default="", help="Additional context passed with every MRD")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories")
+    parser.add_argument("--retry-failed", action="store_true", help="Process files that failed in an earlier run again")
+    parser.add_argument("--use-cache", action="store_true", help="Answer identical requests from the LLM response cache")
+    parser.add_argument("--progress", default=None, help="Progress file (default: MRD_DIR/.prd_batch_progress.json)")
+    parser.add_argument("--report", default="batch_report.json", help="Where to write the JSON report")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"Not a directory: {args.directory}")
+    return run_batch(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
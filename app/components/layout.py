@@ -333,6 +333,47 @@ def render_sidebar_sessions(db, all_sessions: List[Dict], create_new_session_cal
                     st.caption(f"Updated: {session['updated_at'][:10]}")
 
 
+def render_sidebar_search(db, open_result_callback):
+    """Render the full-text search box in sidebar"""
+    if not db.search_enabled:
+        return
+    
+    query = st.text_input("🔎 Search PRDs", placeholder="e.g., calendar integration", key="search_query")
+    if not query:
+        return
+    
+    results = db.search(query, limit=10)
+    if not results:
+        st.caption("No matches found.")
+        return
+    
+    kind_labels = {"content": "PRD", "prompt": "Request", "message": "Chat"}
+    for index, result in enumerate(results):
+        version_label = f"v{result['version_number']}" if result['version_number'] else "chat"
+        if st.button(
+            f"{result['product_name'] or 'Untitled'} · {version_label} · {kind_labels.get(result['kind'], result['kind'])}",
+            key=f"search_hit_{index}_{result['session_id']}_{result['version_number']}",
+            use_container_width=True
+        ):
+            open_result_callback(result['session_id'], result['product_name'], result['version_number'])
+            st.rerun()
+        st.caption(result['snippet'].replace('\n', ' '))
+    
+    st.divider()
+
+
+def render_sidebar_cache_toggle(cache_stats):
+    """Render the AI response cache switch and its hit statistics in sidebar"""
+    st.checkbox(
+        "⚡ Reuse cached AI responses",
+        key="use_llm_cache",
+        help="Identical requests are answered from the local cache. Turn off to always ask the model again."
+    )
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    if lookups:
+        st.caption(f"Cache: {cache_stats['hits']}/{lookups} hits · {cache_stats['entries']} stored responses")
+
+
 def render_sidebar_download(download_prd_callback):
     """Render the download PRD section in sidebar"""
     if st.session_state.current_prd and st.session_state.viewing_version == st.session_state.current_version:
@@ -690,6 +731,12 @@ def render_prd_preview_content(current_content: str, loading: bool = False, mess
         )
 
 
+def render_cancel_generation_button(cancel_callback):
+    """Render the button that stops the PRD generation in progress"""
+    if st.button("⏹️ Cancel generation", key="cancel_generation", use_container_width=True):
+        cancel_callback()
+
+
 def render_prd_skeleton_loading(message: str = "🤖 AI is generating your PRD..."):
     """Render a skeleton loading animation for PRD content while it's being generated.
     
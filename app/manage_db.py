@@ -0,0 +1,78 @@
+"""
+Maintenance commands for the PRD history database.
+
+Usage:
+    python -m app.manage_db [--db prd_history.db] convert-storage --mode delta
+    python -m app.manage_db [--db prd_history.db] check-sessions [--repair]
+    python -m app.manage_db [--db prd_history.db] prune-telemetry [--days 30]
+"""
+
+import argparse
+import sys
+
+from .utils.database import PRDDatabase
+
+
+def convert_storage(args) -> int:
+    """Re-encode all stored versions under the requested storage mode"""
+    db = PRDDatabase(args.db, storage_mode=args.mode, keyframe_interval=args.keyframe_interval,
+                     compress_deltas=not args.no_compress)
+    rewritten = db.convert_storage()
+    print(f"✅ Converted {rewritten} version rows to '{args.mode}' storage")
+    db.close()
+    return 0
+
+
+def check_sessions(args) -> int:
+    """Verify the denormalized session counters, optionally repairing them"""
+    db = PRDDatabase(args.db)
+    mismatches = db.check_session_stats(repair=args.repair)
+    db.close()
+
+    if not mismatches:
+        print("✅ All session counters are consistent")
+        return 0
+
+    for mismatch in mismatches:
+        print(f"⚠️  {mismatch['session_id']}: stored {mismatch['stored']} != actual {mismatch['actual']}")
+    if args.repair:
+        print(f"✅ Repaired {len(mismatches)} sessions")
+        return 0
+    print(f"❌ {len(mismatches)} inconsistent sessions (re-run with --repair to fix)")
+    return 1
+
+
+def prune_telemetry(args) -> int:
+    """Delete LLM call records older than the retention period"""
+    db = PRDDatabase(args.db)
+    deleted = db.prune_llm_calls(args.days)
+    db.close()
+    print(f"✅ Deleted {deleted} LLM call records older than {args.days} days")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage_db", description="PRD history database maintenance")
+    parser.add_argument("--db", default="prd_history.db", help="Path to the SQLite database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert-storage", help="Convert versions between full and delta storage")
+    convert.add_argument("--mode", choices=["full", "delta"], required=True)
+    convert.add_argument("--keyframe-interval", type=int, default=10, help="Store a full keyframe every N versions")
+    convert.add_argument("--no-compress", action="store_true", help="Store deltas without zlib compression")
+    convert.set_defaults(handler=convert_storage)
+
+    check = subparsers.add_parser("check-sessions", help="Check the session summary counters against versions and messages")
+    check.add_argument("--repair", action="store_true", help="Recompute inconsistent counters")
+    check.set_defaults(handler=check_sessions)
+
+    prune = subparsers.add_parser("prune-telemetry", help="Delete old LLM call telemetry records")
+    prune.add_argument("--days", type=int, default=30, help="Keep records of the last N days")
+    prune.set_defaults(handler=prune_telemetry)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
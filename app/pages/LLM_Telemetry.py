@@ -0,0 +1,95 @@
+import streamlit as st
+from dotenv import load_dotenv
+import os
+import sys
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+from utils.database import PRDDatabase
+from utils.telemetry import percentile, summarize_llm_calls, start_telemetry
+
+TIME_WINDOWS = {"Last hour": 1, "Last 24 hours": 24, "Last 7 days": 24 * 7, "Last 30 days": 24 * 30}
+
+st.set_page_config(page_title="LLM Telemetry", layout="wide")
+
+@st.cache_resource
+def init_database():
+    return PRDDatabase()
+
+db = init_database()
+
+st.title("📊 LLM Telemetry")
+st.caption("Latency, token usage and errors of every LLM call made by the generator and the batch CLI.")
+
+window = st.sidebar.selectbox("Time window", list(TIME_WINDOWS), index=1)
+since_hours = TIME_WINDOWS[window]
+
+# Records are buffered - write out what this server process has collected so far
+writer = start_telemetry(db)
+if writer:
+    writer.flush()
+    if writer.dropped:
+        st.sidebar.warning(f"{writer.dropped} call records were dropped because the write buffer was full")
+else:
+    st.sidebar.info("Telemetry is disabled (LLM_TELEMETRY_ENABLED=false)")
+
+calls = db.get_llm_calls(since_hours)
+if not calls:
+    st.info(f"No LLM calls recorded in the selected window ({window.lower()}).")
+    st.stop()
+
+requests = [call for call in calls if call['status'] != "cached"]
+latencies = [call['latency_ms'] for call in requests if call['status'] == "ok"]
+errors = [call for call in requests if call['status'] == "error"]
+total_tokens = sum((call['prompt_tokens'] or 0) + (call['completion_tokens'] or 0) for call in requests)
+
+# ========== PŘEHLED ==========
+col1, col2, col3, col4, col5 = st.columns(5)
+col1.metric("Calls", len(calls), help=f"{len(calls) - len(requests)} answered from the response cache")
+col2.metric("Error rate", f"{len(errors) / len(requests):.1%}" if requests else "–")
+col3.metric("p50 latency", f"{percentile(latencies, 50) / 1000:.2f} s" if latencies else "–")
+col4.metric("p95 latency", f"{percentile(latencies, 95) / 1000:.2f} s" if latencies else "–")
+col5.metric("Tokens", f"{total_tokens:,}")
+
+# ========== PODLE FUNKCE ==========
+st.subheader("By function")
+st.dataframe(summarize_llm_calls(calls), use_container_width=True, hide_index=True)
+
+# ========== CHYBY ==========
+st.subheader("Errors")
+if errors:
+    by_kind = {}
+    for call in errors:
+        key = (call['function'], call['error_kind'] or "unknown")
+        by_kind[key] = by_kind.get(key, 0) + 1
+    st.dataframe(
+        [{'function': function, 'error_kind': kind, 'count': count}
+         for (function, kind), count in sorted(by_kind.items(), key=lambda item: -item[1])],
+        use_container_width=True,
+        hide_index=True
+    )
+else:
+    st.success("No failed calls in this window")
+
+# ========== TOKENY PODLE SESSION ==========
+st.subheader("Tokens per session")
+st.dataframe(db.get_llm_usage_by_session(since_hours), use_container_width=True, hide_index=True)
+
+# ========== LATENCE V ČASE ==========
+st.subheader("Latency over time")
+by_hour = {}
+for call in requests:
+    if call['status'] == "ok":
+        by_hour.setdefault(call['created_at'][:13] + ":00", []).append(call['latency_ms'])
+if by_hour:
+    st.line_chart(
+        {
+            'hour (UTC)': list(by_hour),
+            'p50_ms': [percentile(values, 50) for values in by_hour.values()],
+            'p95_ms': [percentile(values, 95) for values in by_hour.values()],
+        },
+        x='hour (UTC)'
+    )
@@ -0,0 +1,116 @@
+import os
+import threading
+from typing import Dict, List
+
+from .database import PRDDatabase
+from .llm_scheduler import LLMError
+from .llm_utils import summarize_conversation
+from .mrd_index import count_tokens
+from .telemetry import llm_session
+
+def _recent_turns() -> int:
+    return int(os.environ.get("CONVERSATION_RECENT_TURNS", 4))
+
+def _format_message(message: Dict) -> str:
+    return f"{message['role'].capitalize()}: {message['content']}"
+
+def build_conversation_context(db: PRDDatabase, session_id: str) -> str:
+    """Earlier conversation for an update prompt: the rolling summary plus the turns it does not cover yet.
+
+    Bounded by CONVERSATION_MEMORY_TOKENS whatever the length of the session -
+    unsummarized turns are added raw, newest first, until the budget is spent.
+    """
+    budget = int(os.environ.get("CONVERSATION_MEMORY_TOKENS", 1500))
+    memory = db.get_conversation_memory(session_id)
+    # Messages already folded into the summary are not repeated raw; every later one is a
+    # candidate, also those past the raw-turn window that folding has not caught up with
+    recent = db.get_chat_messages_after(session_id, memory['summarized_until'])
+    if not memory['summary'] and not recent:
+        return ""
+
+    remaining = budget - count_tokens(memory['summary'])
+    lines: List[str] = []
+    for message in reversed(recent):
+        line = _format_message(message)
+        tokens = count_tokens(line)
+        if tokens > remaining:
+            if not lines and remaining > 50:
+                # Even the latest message alone is too long - keep its beginning
+                lines.append(line[:remaining * 4] + "...")
+            break
+        lines.append(line)
+        remaining -= tokens
+    lines.reverse()
+
+    parts = ["Conversation so far (follow the preferences and instructions the user gave earlier):"]
+    if memory['summary']:
+        parts.append(f"Summary of earlier turns:\n{memory['summary']}")
+    if lines:
+        parts.append("Most recent turns:\n" + "\n".join(lines))
+    return "\n\n".join(parts)
+
+def update_conversation_memory(db: PRDDatabase, session_id: str, product_name: str, use_cache: bool = False) -> int:
+    """Fold messages that left the raw-turn window into the session's summary; returns how many were folded.
+
+    Messages are folded in batches of about CONVERSATION_FOLD_TOKENS, so a long
+    backlog (e.g. after a rollback reset the summary) never becomes one huge
+    request. Folding starts only once CONVERSATION_FOLD_MIN_MESSAGES have
+    accumulated, to keep it at one LLM call every few turns.
+    """
+    window = 2 * _recent_turns()
+    min_messages = int(os.environ.get("CONVERSATION_FOLD_MIN_MESSAGES", 4))
+    batch_tokens = int(os.environ.get("CONVERSATION_FOLD_TOKENS", 3000))
+    summary_tokens = int(os.environ.get("CONVERSATION_SUMMARY_TOKENS", 400))
+    folded = 0
+
+    while True:
+        memory = db.get_conversation_memory(session_id)
+        pending = db.get_chat_messages_after(session_id, memory['summarized_until'])[:-window or None]
+        if len(pending) < min_messages:
+            return folded
+
+        batch, used = [], 0
+        for message in pending:
+            tokens = count_tokens(message['content'])
+            if batch and used + tokens > batch_tokens:
+                break
+            batch.append(message)
+            used += tokens
+
+        summary = summarize_conversation(memory['summary'], batch, product_name, summary_tokens, use_cache=use_cache)
+        if not db.save_conversation_memory(session_id, summary, batch[-1]['id'], memory['summarized_until']):
+            # Another updater got there first - start again from its summary
+            continue
+        folded += len(batch)
+
+# Sessions with an update in progress; a turn finishing meanwhile makes it run once more
+_running = set()
+_dirty = set()
+_lock = threading.Lock()
+
+def schedule_conversation_memory_update(db: PRDDatabase, session_id: str, product_name: str, use_cache: bool = False):
+    """Update the session's summary in a background thread, off the request's critical path"""
+    with _lock:
+        if session_id in _running:
+            _dirty.add(session_id)
+            return
+        _running.add(session_id)
+
+    def run():
+        while True:
+            try:
+                with llm_session(session_id):
+                    update_conversation_memory(db, session_id, product_name, use_cache=use_cache)
+            except LLMError as e:
+                # Unfolded turns are still sent raw while the budget allows; the next turn tries again
+                print(f"Conversation summary update failed: {e.kind}: {e}")
+            except Exception as e:
+                print(f"Conversation summary update failed: {e}")
+            with _lock:
+                if session_id in _dirty:
+                    _dirty.discard(session_id)
+                    continue
+                _running.discard(session_id)
+                return
+
+    threading.Thread(target=run, name="conversation-memory", daemon=True).start()
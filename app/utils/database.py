@@ -1,86 +1,700 @@
 import sqlite3
 import json
+import queue
+import re
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, TypedDict
 import os
 
+from .diff_utils import make_line_delta, apply_line_delta
+
+# Storage encodings of a row in the versions table
+STORAGE_FULL = 'full'              # complete text in the content column
+STORAGE_DELTA = 'delta'            # JSON line delta against the previous version in the delta column
+STORAGE_DELTA_ZLIB = 'delta+zlib'  # same as 'delta', zlib-compressed
+
+# Denormalized session counters recomputed from versions and chat_messages
+SESSION_SUMMARY_SQL = '''
+    SELECT s.session_id,
+           s.version_count, s.latest_version, s.last_message_at,
+           (SELECT COUNT(*) FROM versions v WHERE v.session_id = s.session_id),
+           (SELECT COALESCE(MAX(v.version_number), 0) FROM versions v WHERE v.session_id = s.session_id),
+           (SELECT MAX(m.created_at) FROM chat_messages m WHERE m.session_id = s.session_id)
+    FROM sessions s
+'''
+SESSION_SUMMARY_REPAIR_SQL = '''
+    UPDATE sessions SET
+        version_count = (SELECT COUNT(*) FROM versions v WHERE v.session_id = sessions.session_id),
+        latest_version = (SELECT COALESCE(MAX(v.version_number), 0) FROM versions v WHERE v.session_id = sessions.session_id),
+        last_message_at = (SELECT MAX(m.created_at) FROM chat_messages m WHERE m.session_id = sessions.session_id)
+'''
+
+# Columns of an llm_calls record, as written by utils.telemetry
+LLM_CALL_COLUMNS = (
+    'created_at', 'session_id', 'function', 'provider', 'model', 'status', 'error_kind',
+    'prompt_tokens', 'completion_tokens', 'latency_ms', 'ttft_ms', 'retries', 'streamed'
+)
+
+# Schema migrations - applied in order, each one must be idempotent so that
+# databases created before schema_version existed can be brought up to date
+
+def _migrate_initial_schema(cursor: sqlite3.Cursor):
+    """Create the sessions, versions and chat_messages tables"""
+    # Create sessions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            product_name TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create versions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            version_number INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            section_name TEXT,
+            change_description TEXT,
+            user_prompt TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        )
+    ''')
+    
+    # Add user_prompt column if it doesn't exist (databases from before prompt history)
+    cursor.execute("PRAGMA table_info(versions)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'user_prompt' not in columns:
+        cursor.execute('ALTER TABLE versions ADD COLUMN user_prompt TEXT')
+    
+    # Create chat_messages table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            message_type TEXT NOT NULL, -- 'user' or 'assistant'
+            content TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        )
+    ''')
+
+def _migrate_delta_storage(cursor: sqlite3.Cursor):
+    """Add the storage and delta columns used by delta-compressed versions"""
+    cursor.execute("PRAGMA table_info(versions)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'storage' not in columns:
+        cursor.execute(f"ALTER TABLE versions ADD COLUMN storage TEXT NOT NULL DEFAULT '{STORAGE_FULL}'")
+    if 'delta' not in columns:
+        cursor.execute('ALTER TABLE versions ADD COLUMN delta BLOB')
+
+def _migrate_session_indexes(cursor: sqlite3.Cursor):
+    """Index the per-session lookups and created_at range scans"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_versions_session_version
+        ON versions (session_id, version_number)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_versions_session_created
+        ON versions (session_id, created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created
+        ON chat_messages (session_id, created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated
+        ON sessions (updated_at)
+    ''')
+
+def _migrate_message_version_link(cursor: sqlite3.Cursor):
+    """Link chat messages to the version they produced and backfill existing rows"""
+    cursor.execute("PRAGMA table_info(chat_messages)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'version_id' not in columns:
+        cursor.execute('ALTER TABLE chat_messages ADD COLUMN version_id INTEGER REFERENCES versions (id)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_version
+        ON chat_messages (version_id)
+    ''')
+    
+    # Backfill with the old timestamp correlation: the first unlinked assistant message at or
+    # after the version, and the user message right before it when it matches the prompt
+    versions = cursor.execute('''
+        SELECT id, session_id, version_number, user_prompt, created_at
+        FROM versions ORDER BY session_id, version_number
+    ''').fetchall()
+    for version_id, session_id, version_number, user_prompt, created_at in versions:
+        assistant = cursor.execute('''
+            SELECT id FROM chat_messages
+            WHERE session_id = ? AND message_type = 'assistant' AND created_at >= ? AND version_id IS NULL
+            ORDER BY created_at ASC, id ASC
+            LIMIT 1
+        ''', (session_id, created_at)).fetchone()
+        if not assistant:
+            continue
+        cursor.execute("UPDATE chat_messages SET version_id = ? WHERE id = ?", (version_id, assistant[0]))
+        
+        if version_number > 1 and user_prompt:
+            cursor.execute('''
+                UPDATE chat_messages SET version_id = ?
+                WHERE id = (
+                    SELECT id FROM chat_messages
+                    WHERE session_id = ? AND message_type = 'user' AND id < ? AND version_id IS NULL
+                    ORDER BY id DESC
+                    LIMIT 1
+                ) AND content = ?
+            ''', (version_id, session_id, assistant[0], user_prompt))
+
+def _migrate_unique_version_numbers(cursor: sqlite3.Cursor):
+    """Renumber duplicated version numbers and enforce UNIQUE(session_id, version_number)"""
+    # Sessions hit by concurrent writers may hold duplicates - renumber them in insertion order
+    cursor.execute('''
+        UPDATE versions SET version_number = (
+            SELECT ranked.new_number FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY version_number, id) AS new_number
+                FROM versions
+            ) AS ranked
+            WHERE ranked.id = versions.id
+        )
+        WHERE session_id IN (
+            SELECT session_id FROM versions
+            GROUP BY session_id, version_number
+            HAVING COUNT(*) > 1
+        )
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_versions_session_version')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_versions_session_version
+        ON versions (session_id, version_number)
+    ''')
+
+def _migrate_session_summary(cursor: sqlite3.Cursor):
+    """Store version_count, latest_version and last_message_at on sessions and backfill them"""
+    cursor.execute("PRAGMA table_info(sessions)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'version_count' not in columns:
+        cursor.execute('ALTER TABLE sessions ADD COLUMN version_count INTEGER NOT NULL DEFAULT 0')
+    if 'latest_version' not in columns:
+        cursor.execute('ALTER TABLE sessions ADD COLUMN latest_version INTEGER NOT NULL DEFAULT 0')
+    if 'last_message_at' not in columns:
+        cursor.execute('ALTER TABLE sessions ADD COLUMN last_message_at DATETIME')
+    cursor.execute(SESSION_SUMMARY_REPAIR_SQL)
+
+def _fts5_available(cursor: sqlite3.Cursor) -> bool:
+    """Whether this SQLite build ships the FTS5 extension"""
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        cursor.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _migrate_search_index(cursor: sqlite3.Cursor):
+    """Create the FTS5 search index over versions and chat messages"""
+    if not _fts5_available(cursor):
+        print("⚠️ SQLite was built without FTS5 - full-text search is disabled")
+        return
+    
+    # rowid encodes the source row: versions.id * 4 (+0 content, +1 prompt), chat_messages.id * 4 + 2
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            body,
+            kind UNINDEXED,       -- 'content', 'prompt' or 'message'
+            session_id UNINDEXED,
+            tokenize = 'porter unicode61'
+        )
+    ''')
+    # Deletes (rollback, cleanup) are mirrored by triggers; inserts are indexed by
+    # PRDDatabase because delta-encoded rows do not carry their text in the table
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS versions_search_delete AFTER DELETE ON versions BEGIN
+            DELETE FROM search_index WHERE rowid IN (old.id * 4, old.id * 4 + 1);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_messages_search_delete AFTER DELETE ON chat_messages BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 4 + 2;
+        END
+    ''')
+    
+    # The backfill is left to migration 14, which rebuilds this table as a contentless index
+
+def _migrate_jobs(cursor: sqlite3.Cursor):
+    """Create the background job table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed, cancelled
+            params TEXT NOT NULL,
+            partial_output TEXT,
+            result TEXT,
+            error TEXT,
+            error_kind TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        )
+    ''')
+    # At most one unfinished job per session - a second tab cannot start a parallel turn
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_session
+        ON jobs (session_id) WHERE status IN ('queued', 'running')
+    ''')
+
+def _migrate_llm_calls(cursor: sqlite3.Cursor):
+    """Create the per-call LLM telemetry table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at DATETIME NOT NULL,
+            session_id TEXT,  -- NULL for calls outside a session, e.g. batch runs before the session exists
+            function TEXT NOT NULL,
+            provider TEXT,
+            model TEXT,
+            status TEXT NOT NULL,  -- ok, cached, cancelled, error
+            error_kind TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            latency_ms REAL,
+            ttft_ms REAL,
+            retries INTEGER DEFAULT 0,
+            streamed INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_created_at ON llm_calls (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_session ON llm_calls (session_id)")
+
+def _migrate_mrd_chunks(cursor: sqlite3.Cursor):
+    """Create the per-session MRD chunk table used for retrieval"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mrd_chunks (
+            session_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            heading TEXT,
+            content TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            PRIMARY KEY (session_id, chunk_index),
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        )
+    ''')
+
+def _migrate_conversation_memory(cursor: sqlite3.Cursor):
+    """Create the rolling conversation summary table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_memory (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_until INTEGER NOT NULL,  -- id of the last chat message folded into the summary
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        )
+    ''')
+
+def _migrate_mrd_documents(cursor: sqlite3.Cursor):
+    """Create the extracted text cache and the per-session MRD documents referencing it"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS extracted_texts (
+            sha256 TEXT PRIMARY KEY,  -- of the uploaded file's bytes
+            content TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_extracted_texts_last_access ON extracted_texts (last_access)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mrd_documents (
+            session_id TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            file_name TEXT,
+            file_size INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id),
+            FOREIGN KEY (sha256) REFERENCES extracted_texts (sha256)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mrd_documents_sha256 ON mrd_documents (sha256)")
+
+def _migrate_job_owner(cursor: sqlite3.Cursor):
+    """Record which server process runs a job, for its heartbeat"""
+    cursor.execute("PRAGMA table_info(jobs)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'owner' not in columns:
+        cursor.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+
+def _migrate_contentless_search_index(cursor: sqlite3.Cursor):
+    """Rebuild the search index as a contentless FTS5 table and backfill it.
+
+    The index keeps only the tokens - snippets are built from the versions and
+    chat messages themselves (see PRDDatabase.search), so no text is stored twice.
+    """
+    cursor.execute("DROP TRIGGER IF EXISTS versions_search_delete")
+    cursor.execute("DROP TRIGGER IF EXISTS chat_messages_search_delete")
+    cursor.execute("DROP TABLE IF EXISTS search_index")
+    if not _fts5_available(cursor):
+        print("⚠️ SQLite was built without FTS5 - full-text search is disabled")
+        return
+    
+    # rowid encodes the source row: versions.id * 4 (+0 content, +1 prompt), chat_messages.id * 4 + 2
+    cursor.execute('''
+        CREATE VIRTUAL TABLE search_index USING fts5(
+            body,
+            content = '',
+            tokenize = 'porter unicode61'
+        )
+    ''')
+    # A contentless row is deleted by replaying its original text. Chat messages are
+    # stored as-is, so a trigger can do that; version rows are removed by
+    # PRDDatabase._unindex_versions, which decodes delta-encoded bodies first
+    cursor.execute('''
+        CREATE TRIGGER chat_messages_search_delete AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO search_index (search_index, rowid, body) VALUES ('delete', old.id * 4 + 2, old.content);
+        END
+    ''')
+    
+    # Versions are read through their own cursor and decoded one row at a time
+    rows = cursor.connection.execute('''
+        SELECT id, session_id, content, storage, delta, user_prompt
+        FROM versions ORDER BY session_id, version_number
+    ''')
+    previous = None
+    previous_session = None
+    for version_id, session_id, body, storage, delta, user_prompt in rows:
+        if session_id != previous_session:
+            previous, previous_session = None, session_id
+        previous = PRDDatabase._decode_content(previous, body, storage, delta)
+        cursor.execute("INSERT INTO search_index (rowid, body) VALUES (?, ?)", (version_id * 4, previous))
+        if user_prompt:
+            cursor.execute("INSERT INTO search_index (rowid, body) VALUES (?, ?)", (version_id * 4 + 1, user_prompt))
+    cursor.execute("INSERT INTO search_index (rowid, body) SELECT id * 4 + 2, content FROM chat_messages")
+
+MIGRATIONS = [
+    (1, "Initial schema", _migrate_initial_schema),
+    (2, "Delta storage columns on versions", _migrate_delta_storage),
+    (3, "Session lookup indexes", _migrate_session_indexes),
+    (4, "Link chat messages to versions", _migrate_message_version_link),
+    (5, "Unique version numbers per session", _migrate_unique_version_numbers),
+    (6, "Session summary counters", _migrate_session_summary),
+    (7, "Full-text search index", _migrate_search_index),
+    (8, "Background jobs", _migrate_jobs),
+    (9, "LLM call telemetry", _migrate_llm_calls),
+    (10, "MRD chunks", _migrate_mrd_chunks),
+    (11, "Conversation memory", _migrate_conversation_memory),
+    (12, "Extracted text cache and MRD documents", _migrate_mrd_documents),
+    (13, "Job owner", _migrate_job_owner),
+    (14, "Contentless search index", _migrate_contentless_search_index),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+class VersionInfo(TypedDict):
+    """Version metadata without the PRD body, for listings and navigation"""
+    version_number: int
+    section_name: Optional[str]
+    change_description: Optional[str]
+    created_at: str
+
 class PRDDatabase:
-    def __init__(self, db_path: str = "prd_history.db"):
+    def __init__(self, db_path: str = "prd_history.db", pool_size: int = 5, busy_timeout_ms: int = 5000,
+                 storage_mode: str = "full", keyframe_interval: int = 10, compress_deltas: bool = True):
+        if storage_mode not in ("full", "delta"):
+            raise ValueError(f"Unknown storage mode: {storage_mode}")
         self.db_path = db_path
+        # 'full' stores every version verbatim; 'delta' stores a full keyframe every
+        # keyframe_interval versions and line deltas against the previous version in between
+        self.storage_mode = storage_mode
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.compress_deltas = compress_deltas
+        # An in-memory database only exists inside the connection that created it
+        self.pool_size = 1 if db_path == ":memory:" else max(1, pool_size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._pool_lock = threading.Lock()
+        self._open_connections = 0
         self.init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """Open a long-lived connection in WAL mode with tuned pragmas"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # autocommit; explicit transactions via transaction()
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")  # ~8 MB page cache per connection
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        """Take a connection from the pool, opening a new one while below pool_size.
+
+        Raises sqlite3.OperationalError if the pool stays exhausted for busy_timeout_ms.
+        """
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            if self._open_connections < self.pool_size:
+                conn = self._connect()
+                self._open_connections += 1
+                return conn
+        
+        # Pool exhausted - wait for another thread to hand a connection back
+        try:
+            return self._pool.get(timeout=self.busy_timeout_ms / 1000)
+        except queue.Empty:
+            # Surfaces like a busy database, which callers already handle
+            raise sqlite3.OperationalError(
+                f"No pooled connection became free within {self.busy_timeout_ms} ms (pool_size={self.pool_size})"
+            ) from None
+    
+    def _release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, discarding any unfinished transaction"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            with self._pool_lock:
+                self._open_connections -= 1
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection for the duration of the with-block"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+    
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """Run the with-block in a single transaction, committing on success and rolling back on error"""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+    
+    def close(self):
+        """Close all idle pooled connections"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._pool_lock:
+                self._open_connections -= 1
+    
+    def _get_schema_version(self, conn: sqlite3.Connection) -> int:
+        """Read the applied schema version, 0 for a database that predates schema_version"""
+        try:
+            return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return 0
+    
     def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Bring the schema up to date, skipping all DDL when it is already current"""
+        with self.connection() as conn:
+            current_version = self._get_schema_version(conn)
         
-        # Create sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT UNIQUE NOT NULL,
-                product_name TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        if current_version < SCHEMA_VERSION:
+            self._apply_migrations()
         
-        # Create versions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS versions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                version_number INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                section_name TEXT,
-                change_description TEXT,
-                user_prompt TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        with self.connection() as conn:
+            self.search_enabled = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+            ).fetchone() is not None
+    
+    def _apply_migrations(self):
+        """Apply all pending schema migrations in one transaction"""
+        with self.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Re-read under the write lock in case another process migrated meanwhile
+            current_version = self._get_schema_version(conn)
+            for version, description, migrate in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                print(f"✅ Database migrated to schema v{version}: {description}")
+    
+    def _is_keyframe(self, version_number: int) -> bool:
+        """Whether a version is stored in full under the current storage mode"""
+        if self.storage_mode == "full":
+            return True
+        return (version_number - 1) % self.keyframe_interval == 0
+    
+    def _encode_content(self, version_number: int, content: str, previous_content: Optional[str]) -> tuple:
+        """Encode a version body as (content, storage, delta) column values"""
+        if previous_content is None or self._is_keyframe(version_number):
+            return content, STORAGE_FULL, None
+        
+        delta = json.dumps(make_line_delta(previous_content, content), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        storage = STORAGE_DELTA
+        if self.compress_deltas:
+            delta = zlib.compress(delta)
+            storage = STORAGE_DELTA_ZLIB
+        
+        # A delta that is not smaller than the text itself is not worth the reconstruction cost
+        if len(delta) >= len(content.encode('utf-8')):
+            return content, STORAGE_FULL, None
+        return '', storage, delta
+    
+    @staticmethod
+    def _decode_content(previous_content: Optional[str], content: str, storage: str, delta: Optional[bytes]) -> str:
+        """Decode one row's body given the decoded body of the version before it"""
+        if storage == STORAGE_FULL:
+            return content
+        if previous_content is None:
+            raise ValueError("Delta-encoded version without a preceding keyframe")
+        if storage == STORAGE_DELTA_ZLIB:
+            delta = zlib.decompress(delta)
+        return apply_line_delta(previous_content, json.loads(delta.decode('utf-8')))
+    
+    def _load_content(self, conn: sqlite3.Connection, session_id: str, version_number: int) -> Optional[str]:
+        """Rebuild the text of one version from its nearest keyframe"""
+        rows = conn.execute(f'''
+            SELECT version_number, content, storage, delta
+            FROM versions
+            WHERE session_id = ? AND version_number <= ? AND version_number >= (
+                SELECT MAX(version_number) FROM versions
+                WHERE session_id = ? AND version_number <= ? AND storage = '{STORAGE_FULL}'
             )
-        ''')
+            ORDER BY version_number ASC
+        ''', (session_id, version_number, session_id, version_number)).fetchall()
         
-        # Add user_prompt column if it doesn't exist (migration)
-        cursor.execute("PRAGMA table_info(versions)")
-        columns = [column[1] for column in cursor.fetchall()]
-        if 'user_prompt' not in columns:
-            cursor.execute('ALTER TABLE versions ADD COLUMN user_prompt TEXT')
-            print("✅ Database migrated: Added user_prompt column to versions table")
+        if not rows or rows[-1][0] != version_number:
+            return None
         
-        # Create chat_messages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                message_type TEXT NOT NULL, -- 'user' or 'assistant'
-                content TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        content = None
+        for _, body, storage, delta in rows:
+            content = self._decode_content(content, body, storage, delta)
+        return content
+    
+    def _unindex_versions(self, conn: sqlite3.Connection, session_id: str, after_version: int):
+        """Remove the search rows of a session's versions newer than after_version.
+
+        The index is contentless, so each row is deleted by replaying the text it
+        was indexed with - delta-encoded bodies are decoded from their keyframe first.
+        """
+        rows = conn.execute(f'''
+            SELECT id, version_number, content, storage, delta, user_prompt
+            FROM versions
+            WHERE session_id = ? AND version_number >= COALESCE((
+                SELECT MAX(version_number) FROM versions
+                WHERE session_id = ? AND version_number <= ? AND storage = '{STORAGE_FULL}'
+            ), 0)
+            ORDER BY version_number ASC
+        ''', (session_id, session_id, after_version + 1))
+        
+        content = None
+        for version_id, version_number, body, storage, delta, user_prompt in rows:
+            content = self._decode_content(content, body, storage, delta)
+            if version_number <= after_version:
+                continue
+            conn.execute(
+                "INSERT INTO search_index (search_index, rowid, body) VALUES ('delete', ?, ?)",
+                (version_id * 4, content)
             )
-        ''')
+            if user_prompt:
+                conn.execute(
+                    "INSERT INTO search_index (search_index, rowid, body) VALUES ('delete', ?, ?)",
+                    (version_id * 4 + 1, user_prompt)
+                )
+    
+    def convert_storage(self, storage_mode: Optional[str] = None) -> int:
+        """Re-encode every stored version under the given storage mode (migration).
+
+        Each session is converted in its own transaction and verified to decode
+        to byte-identical text before committing. Returns the number of rows rewritten.
+        """
+        if storage_mode is not None:
+            if storage_mode not in ("full", "delta"):
+                raise ValueError(f"Unknown storage mode: {storage_mode}")
+            self.storage_mode = storage_mode
+        
+        with self.connection() as conn:
+            session_ids = [row[0] for row in conn.execute("SELECT DISTINCT session_id FROM versions")]
         
-        conn.commit()
-        conn.close()
+        rewritten = 0
+        for session_id in session_ids:
+            with self.transaction(immediate=True) as conn:
+                rows = conn.execute('''
+                    SELECT id, version_number, content, storage, delta
+                    FROM versions WHERE session_id = ? ORDER BY version_number ASC
+                ''', (session_id,)).fetchall()
+                
+                previous = None
+                for row_id, version_number, body, storage, delta in rows:
+                    text = self._decode_content(previous, body, storage, delta)
+                    new_body, new_storage, new_delta = self._encode_content(version_number, text, previous)
+                    if self._decode_content(previous, new_body, new_storage, new_delta) != text:
+                        raise ValueError(f"Round-trip mismatch for {session_id} v{version_number}")
+                    if (new_body, new_storage, new_delta) != (body, storage, delta):
+                        conn.execute(
+                            "UPDATE versions SET content = ?, storage = ?, delta = ? WHERE id = ?",
+                            (new_body, new_storage, new_delta, row_id)
+                        )
+                        rewritten += 1
+                    previous = text
+        
+        return rewritten
     
     def create_session(self, session_id: str, product_name: str) -> bool:
         """Create a new session"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO sessions (session_id, product_name) VALUES (?, ?)",
-                (session_id, product_name)
-            )
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, product_name) VALUES (?, ?)",
+                    (session_id, product_name)
+                )
             return True
         except sqlite3.IntegrityError:
             return False
     
-    def save_version(self, session_id: str, content: str, section_name: str = None, 
-                    change_description: str = None, user_prompt: str = None) -> int:
-        """Save a new version of the PRD"""
-        conn = sqlite3.connect(self.db_path)
+    def _insert_version(self, conn: sqlite3.Connection, session_id: str, content: str, section_name: str = None,
+                        change_description: str = None, user_prompt: str = None) -> tuple:
+        """Allocate the next version number and insert the version; returns (version_id, version_number).
+
+        Must run inside a BEGIN IMMEDIATE transaction so that no other writer can
+        allocate the same number between the MAX() read and the insert.
+        """
         cursor = conn.cursor()
         
         # Get current version number
@@ -91,145 +705,290 @@ class PRDDatabase:
         result = cursor.fetchone()
         version_number = (result[0] or 0) + 1
         
+        # Delta-encode against the previous version unless this one is a keyframe
+        previous_content = None
+        if result[0] and not self._is_keyframe(version_number):
+            previous_content = self._load_content(conn, session_id, result[0])
+        body, storage, delta = self._encode_content(version_number, content, previous_content)
+        
         # Insert new version
         cursor.execute('''
-            INSERT INTO versions (session_id, version_number, content, section_name, change_description, user_prompt)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (session_id, version_number, content, section_name, change_description, user_prompt))
+            INSERT INTO versions (session_id, version_number, content, section_name, change_description, user_prompt, storage, delta)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (session_id, version_number, body, section_name, change_description, user_prompt, storage, delta))
+        version_id = cursor.lastrowid
         
-        # Update session timestamp
-        cursor.execute(
-            "UPDATE sessions SET updated_at = CURRENT_TIMESTAMP WHERE session_id = ?",
-            (session_id,)
+        if self.search_enabled:
+            cursor.execute("INSERT INTO search_index (rowid, body) VALUES (?, ?)", (version_id * 4, content))
+            if user_prompt:
+                cursor.execute(
+                    "INSERT INTO search_index (rowid, body) VALUES (?, ?)", (version_id * 4 + 1, user_prompt)
+                )
+        
+        # Update session timestamp and summary counters
+        cursor.execute('''
+            UPDATE sessions
+            SET updated_at = CURRENT_TIMESTAMP, version_count = version_count + 1, latest_version = ?
+            WHERE session_id = ?
+        ''', (version_number, session_id))
+        
+        return version_id, version_number
+    
+    def _insert_chat_message(self, conn: sqlite3.Connection, session_id: str, message_type: str,
+                             content: str, version_id: int = None) -> int:
+        """Insert a chat message and set the session's last_message_at to its created_at; returns the message id.
+
+        Callers run it inside a transaction, so the two writes land together.
+        """
+        cursor = conn.execute('''
+            INSERT INTO chat_messages (session_id, message_type, content, version_id)
+            VALUES (?, ?, ?, ?)
+        ''', (session_id, message_type, content, version_id))
+        message_id = cursor.lastrowid
+        
+        if self.search_enabled:
+            conn.execute("INSERT INTO search_index (rowid, body) VALUES (?, ?)", (message_id * 4 + 2, content))
+        # Taken from the row itself, so the session always sorts by its newest message's own timestamp
+        conn.execute(
+            "UPDATE sessions SET last_message_at = (SELECT created_at FROM chat_messages WHERE id = ?) WHERE session_id = ?",
+            (message_id, session_id)
         )
+        return message_id
+    
+    def save_version(self, session_id: str, content: str, section_name: str = None, 
+                    change_description: str = None, user_prompt: str = None,
+                    assistant_message: str = None, user_message_id: int = None,
+                    job_id: str = None) -> Optional[int]:
+        """Save a new version of the PRD.
+
+        The optional assistant reply is stored and the pending user message is linked
+        to the new version in the same transaction. With job_id the version is only
+        saved if that job is still running (see _claim_job); returns None otherwise.
+        """
+        with self.transaction(immediate=True) as conn:
+            if job_id is not None and not self._claim_job(conn, job_id):
+                return None
+            version_id, version_number = self._insert_version(
+                conn, session_id, content, section_name, change_description, user_prompt
+            )
+            
+            # Link the turn's chat messages to the version they produced
+            if user_message_id is not None:
+                conn.execute(
+                    "UPDATE chat_messages SET version_id = ? WHERE id = ? AND session_id = ?",
+                    (version_id, user_message_id, session_id)
+                )
+            if assistant_message is not None:
+                self._insert_chat_message(conn, session_id, 'assistant', assistant_message, version_id)
         
-        conn.commit()
-        conn.close()
         return version_number
     
+    def commit_turn(self, session_id: str, user_msg: Optional[str], prd: str, summary: str,
+                    assistant_msg: str, section_name: str = "User Request Update",
+                    job_id: str = None) -> Optional[int]:
+        """Persist one chat turn atomically: user message, new PRD version and assistant reply.
+
+        Everything is written in a single BEGIN IMMEDIATE transaction, so concurrent
+        writers to the same session can neither reuse a version number nor leave
+        orphaned messages behind. Returns the allocated version number, or None if
+        job_id was given and that job has been cancelled.
+        """
+        with self.transaction(immediate=True) as conn:
+            if job_id is not None and not self._claim_job(conn, job_id):
+                return None
+            version_id, version_number = self._insert_version(
+                conn, session_id, prd, section_name, summary, user_msg
+            )
+            
+            if user_msg is not None:
+                self._insert_chat_message(conn, session_id, 'user', user_msg, version_id)
+            self._insert_chat_message(conn, session_id, 'assistant', assistant_msg, version_id)
+        
+        return version_number
+    
+    def update_change_description(self, session_id: str, version_number: int, change_description: str) -> bool:
+        """Replace the change description of an existing version"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE versions SET change_description = ? WHERE session_id = ? AND version_number = ?",
+                (change_description, session_id, version_number)
+            )
+            return cursor.rowcount > 0
+    
     def get_versions(self, session_id: str) -> List[Dict]:
         """Get all versions for a session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT version_number, content, section_name, change_description, user_prompt, created_at
-            FROM versions 
-            WHERE session_id = ? 
-            ORDER BY version_number DESC
-        ''', (session_id,))
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                SELECT version_number, content, section_name, change_description, user_prompt, created_at, storage, delta
+                FROM versions 
+                WHERE session_id = ? 
+                ORDER BY version_number ASC
+            ''', (session_id,))
+            rows = cursor.fetchall()
         
         versions = []
-        for row in cursor.fetchall():
+        content = None
+        for row in rows:
+            # Rows come oldest first so each delta can build on the decoded text before it
+            content = self._decode_content(content, row[1], row[6], row[7])
             versions.append({
                 'version_number': row[0],
-                'content': row[1],
+                'content': content,
                 'section_name': row[2],
                 'change_description': row[3],
                 'user_prompt': row[4],
                 'created_at': row[5]
             })
         
-        conn.close()
+        versions.reverse()
         return versions
     
+    def list_versions(self, session_id: str) -> List[VersionInfo]:
+        """List version metadata for a session, newest first, without loading any content"""
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT version_number, section_name, change_description, created_at
+                FROM versions
+                WHERE session_id = ?
+                ORDER BY version_number DESC
+            ''', (session_id,)).fetchall()
+        
+        return [
+            VersionInfo(version_number=row[0], section_name=row[1], change_description=row[2], created_at=row[3])
+            for row in rows
+        ]
+    
     def get_latest_version(self, session_id: str) -> Optional[Dict]:
         """Get the latest version of PRD for a session"""
-        versions = self.get_versions(session_id)
-        return versions[0] if versions else None
+        max_version = self.get_max_version_number(session_id)
+        return self.get_version_by_number(session_id, max_version) if max_version else None
     
-    def save_chat_message(self, session_id: str, message_type: str, content: str):
-        """Save a chat message"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO chat_messages (session_id, message_type, content)
-            VALUES (?, ?, ?)
-        ''', (session_id, message_type, content))
-        
-        conn.commit()
-        conn.close()
+    def save_chat_message(self, session_id: str, message_type: str, content: str) -> int:
+        """Save a chat message and return its id"""
+        with self.transaction() as conn:
+            return self._insert_chat_message(conn, session_id, message_type, content)
     
     def get_chat_history(self, session_id: str) -> List[Dict]:
         """Get chat history for a session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT message_type, content, created_at
-            FROM chat_messages 
-            WHERE session_id = ? 
-            ORDER BY created_at ASC
-        ''', (session_id,))
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                SELECT message_type, content, created_at
+                FROM chat_messages 
+                WHERE session_id = ? 
+                ORDER BY created_at ASC, id ASC
+            ''', (session_id,))
+            rows = cursor.fetchall()
         
         messages = []
-        for row in cursor.fetchall():
+        for row in rows:
             messages.append({
                 'role': row[0],  # Use 'role' instead of 'type' for consistency
                 'content': row[1],
                 'timestamp': row[2]
             })
         
-        conn.close()
         return messages
     
+    def get_chat_messages_after(self, session_id: str, after_id: int) -> List[Dict]:
+        """Chat messages with an id greater than after_id, oldest first"""
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, message_type, content
+                FROM chat_messages
+                WHERE session_id = ? AND id > ?
+                ORDER BY id ASC
+            ''', (session_id, after_id)).fetchall()
+        return [{'id': row[0], 'role': row[1], 'content': row[2]} for row in rows]
+    
+    def get_conversation_memory(self, session_id: str) -> Dict:
+        """The session's rolling conversation summary and the last message id it covers"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT summary, summarized_until FROM conversation_memory WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        if not row:
+            return {'summary': "", 'summarized_until': 0}
+        return {'summary': row[0], 'summarized_until': row[1]}
+    
+    def save_conversation_memory(self, session_id: str, summary: str, summarized_until: int,
+                                 expected_until: int) -> bool:
+        """Store a new summary only if the stored one still ends at expected_until.
+
+        Two updaters working from the same state cannot overwrite each other's
+        progress; the loser gets False and simply starts over.
+        """
+        with self.connection() as conn:
+            if expected_until == 0:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO conversation_memory (session_id, summary, summarized_until) VALUES (?, ?, ?)",
+                    (session_id, summary, summarized_until)
+                )
+            else:
+                cursor = conn.execute('''
+                    UPDATE conversation_memory
+                    SET summary = ?, summarized_until = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE session_id = ? AND summarized_until = ?
+                ''', (summary, summarized_until, session_id, expected_until))
+            return cursor.rowcount > 0
+    
     def get_chat_history_until_version(self, session_id: str, version_number: int, context_limit: int = 5) -> Dict:
         """Get chat history up to a specific version with the version message highlighted"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get the version data
-        cursor.execute('''
-            SELECT created_at, user_prompt 
-            FROM versions 
-            WHERE session_id = ? AND version_number = ?
-        ''', (session_id, version_number))
-        
-        version_result = cursor.fetchone()
-        if not version_result:
-            conn.close()
-            return {'context_messages': [], 'version_message': None, 'assistant_response': None}
-        
-        version_timestamp = version_result[0]
-        version_user_prompt = version_result[1]
-        
-        # If it's version 1, there's no chat history before it
-        if version_number == 1:
-            # For version 1, the version message is the initial request
-            version_message = None
-            if version_user_prompt:
-                version_message = {
-                    'role': 'user',
-                    'content': version_user_prompt,
-                    'timestamp': version_timestamp
-                }
+        with self.connection() as conn:
+            # The version and the messages linked to it in one indexed join
+            rows = conn.execute('''
+                SELECT v.created_at, v.user_prompt, m.id, m.message_type, m.content, m.created_at
+                FROM versions v
+                LEFT JOIN chat_messages m ON m.version_id = v.id
+                WHERE v.session_id = ? AND v.version_number = ?
+                ORDER BY m.id ASC
+            ''', (session_id, version_number)).fetchall()
             
-            # Get the first assistant response after version 1 creation
-            assistant_response = self._get_assistant_response_for_version(session_id, version_timestamp)
+            if not rows:
+                return {'context_messages': [], 'version_message': None, 'assistant_response': None}
             
-            conn.close()
-            return {
-                'context_messages': [],
-                'version_message': version_message,
-                'assistant_response': assistant_response
-            }
+            version_timestamp = rows[0][0]
+            version_user_prompt = rows[0][1]
+            linked = [row for row in rows if row[2] is not None]
+            
+            # Previous conversation: the messages right before this version's turn
+            context_rows = []
+            if version_number != 1 and linked:
+                context_rows = conn.execute('''
+                    SELECT message_type, content, created_at
+                    FROM chat_messages
+                    WHERE session_id = ? AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (session_id, linked[0][2], context_limit)).fetchall()
+                context_rows.reverse()
+            elif version_number != 1:
+                # No message linked to this version (the migration backfill could not
+                # match it) - fall back to the messages written before the version
+                context_rows = conn.execute('''
+                    SELECT message_type, content, created_at
+                    FROM chat_messages
+                    WHERE session_id = ? AND created_at < ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ''', (session_id, version_timestamp, context_limit)).fetchall()
+                context_rows.reverse()
+            
+            fallback_response = None
+            if not linked:
+                # Likewise the first assistant message written at or after the version
+                fallback_response = conn.execute('''
+                    SELECT content, created_at
+                    FROM chat_messages
+                    WHERE session_id = ? AND message_type = 'assistant' AND created_at >= ?
+                    ORDER BY created_at ASC, id ASC
+                    LIMIT 1
+                ''', (session_id, version_timestamp)).fetchone()
         
-        # For versions > 1, get messages up to this version's timestamp
-        cursor.execute('''
-            SELECT message_type, content, created_at
-            FROM chat_messages 
-            WHERE session_id = ? AND created_at < ?
-            ORDER BY created_at ASC
-        ''', (session_id, version_timestamp))
-        
-        all_messages = []
-        for row in cursor.fetchall():
-            all_messages.append({
-                'role': row[0],
-                'content': row[1],
-                'timestamp': row[2]
-            })
+        context_messages = [
+            {'role': row[0], 'content': row[1], 'timestamp': row[2]}
+            for row in context_rows
+        ]
         
         # Now get the version message (the one that triggered this version)
         version_message = None
@@ -240,13 +999,22 @@ class PRDDatabase:
                 'timestamp': version_timestamp
             }
         
-        # Get assistant response for this version
-        assistant_response = self._get_assistant_response_for_version(session_id, version_timestamp)
-        
-        # Get only the last context_limit messages as context
-        context_messages = all_messages[-context_limit:] if len(all_messages) > context_limit else all_messages
-        
-        conn.close()
+        # Assistant response that was saved together with this version
+        assistant_response = None
+        for row in linked:
+            if row[3] == 'assistant':
+                assistant_response = {
+                    'role': 'assistant',
+                    'content': row[4],
+                    'timestamp': row[5]
+                }
+                break
+        if fallback_response:
+            assistant_response = {
+                'role': 'assistant',
+                'content': fallback_response[0],
+                'timestamp': fallback_response[1]
+            }
         
         return {
             'context_messages': context_messages,
@@ -254,78 +1022,72 @@ class PRDDatabase:
             'assistant_response': assistant_response
         }
     
-    def _get_assistant_response_for_version(self, session_id: str, version_timestamp: str) -> Dict:
-        """Get the assistant response that was created after a specific version"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get the next assistant message that was created at or after the version timestamp
-        # Use >= instead of > to catch messages created at the same timestamp
-        cursor.execute('''
-            SELECT content, created_at
-            FROM chat_messages 
-            WHERE session_id = ? AND message_type = 'assistant' AND created_at >= ?
-            ORDER BY created_at ASC
-            LIMIT 1
-        ''', (session_id, version_timestamp))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            return {
-                'role': 'assistant',
-                'content': result[0],
-                'timestamp': result[1]
-            }
-        
-        return None
-    
     def get_all_sessions(self) -> List[Dict]:
         """Get all sessions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT s.session_id, s.product_name, s.created_at, s.updated_at,
-                   COUNT(v.id) as version_count
-            FROM sessions s
-            LEFT JOIN versions v ON s.session_id = v.session_id
-            GROUP BY s.session_id, s.product_name, s.created_at, s.updated_at
-            ORDER BY s.updated_at DESC
-        ''')
+        with self.connection() as conn:
+            # Counters are maintained on write, so listing never touches versions
+            cursor = conn.execute('''
+                SELECT session_id, product_name, created_at, updated_at,
+                       version_count, latest_version, last_message_at
+                FROM sessions
+                ORDER BY updated_at DESC
+            ''')
+            rows = cursor.fetchall()
         
         sessions = []
-        for row in cursor.fetchall():
+        for row in rows:
             sessions.append({
                 'session_id': row[0],
                 'product_name': row[1],
                 'created_at': row[2],
                 'updated_at': row[3],
-                'version_count': row[4]
+                'version_count': row[4],
+                'latest_version': row[5],
+                'last_message_at': row[6]
             })
         
-        conn.close()
         return sessions
     
+    def check_session_stats(self, repair: bool = False) -> List[Dict]:
+        """Find sessions whose summary counters disagree with versions/chat_messages.
+
+        With repair=True the counters of every session are recomputed. Returns the
+        mismatches found before any repair.
+        """
+        with self.transaction(immediate=repair) as conn:
+            mismatches = []
+            for row in conn.execute(SESSION_SUMMARY_SQL).fetchall():
+                stored, actual = row[1:4], row[4:7]
+                if stored != actual:
+                    mismatches.append({
+                        'session_id': row[0],
+                        'stored': dict(zip(('version_count', 'latest_version', 'last_message_at'), stored)),
+                        'actual': dict(zip(('version_count', 'latest_version', 'last_message_at'), actual))
+                    })
+            
+            if repair and mismatches:
+                conn.execute(SESSION_SUMMARY_REPAIR_SQL)
+        
+        return mismatches
+    
     def get_version_by_number(self, session_id: str, version_number: int) -> Optional[Dict]:
         """Get specific version by number"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT version_number, content, section_name, change_description, user_prompt, created_at
-            FROM versions 
-            WHERE session_id = ? AND version_number = ?
-        ''', (session_id, version_number))
-        
-        result = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            result = conn.execute('''
+                SELECT version_number, content, section_name, change_description, user_prompt, created_at, storage
+                FROM versions 
+                WHERE session_id = ? AND version_number = ?
+            ''', (session_id, version_number)).fetchone()
+            
+            content = None
+            if result:
+                # Keyframes are read directly, deltas walk back to the nearest keyframe
+                content = result[1] if result[6] == STORAGE_FULL else self._load_content(conn, session_id, version_number)
         
         if result:
             return {
                 'version_number': result[0],
-                'content': result[1],
+                'content': content,
                 'section_name': result[2],
                 'change_description': result[3],
                 'user_prompt': result[4],
@@ -335,61 +1097,418 @@ class PRDDatabase:
     
     def get_max_version_number(self, session_id: str) -> int:
         """Get the highest version number for a session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            result = conn.execute(
+                "SELECT MAX(version_number) FROM versions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        return result[0] or 0
+    
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """Turn free text into a safe FTS5 query: every word quoted, a trailing * kept as prefix search"""
+        terms = []
+        for term in text.split():
+            prefix = term.endswith('*') and len(term) > 1
+            term = term.rstrip('*')
+            if term:
+                terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+        return ' '.join(terms)
+    
+    @staticmethod
+    def _snippet(text: str, query: str, words: int = 16) -> str:
+        """About `words` words of text around the first query term, terms marked with **.
+
+        Stands in for FTS5's snippet(), which a contentless index cannot build. Terms
+        match words by prefix after dropping a common suffix, close enough to the
+        porter stemmer for highlighting.
+        """
+        stems = []
+        for term in query.split():
+            term = re.sub(r'\W', '', term.lower())
+            for suffix in ('ing', 'ed', 'es', 's'):
+                if term.endswith(suffix) and len(term) - len(suffix) >= 3:
+                    term = term[:-len(suffix)]
+                    break
+            if term:
+                stems.append(term)
         
-        cursor.execute(
-            "SELECT MAX(version_number) FROM versions WHERE session_id = ?",
-            (session_id,)
+        tokens = text.split()
+        marked = [any(re.sub(r'\W', '', token.lower()).startswith(stem) for stem in stems) for token in tokens]
+        first = marked.index(True) if True in marked else 0
+        start = max(0, first - words // 4)
+        stop = start + words
+        excerpt = ' '.join(
+            f"**{token}**" if hit else token
+            for token, hit in zip(tokens[start:stop], marked[start:stop])
         )
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] or 0
+        return ('…' if start > 0 else '') + excerpt + ('…' if stop < len(tokens) else '')
+    
+    def search(self, query: str, limit: int = 20, session_id: str = None) -> List[Dict]:
+        """Full-text search over PRD versions, prompts and chat messages, best matches first"""
+        match = self._fts_query(query)
+        if not self.search_enabled or not match:
+            return []
+        
+        # The index holds no columns besides the tokens - the session comes from the source row,
+        # so a session filter is applied after the join and the hits cannot be cut off earlier
+        if session_id:
+            inner_limit, session_filter = "", "WHERE COALESCE(v.session_id, m.session_id) = ?"
+            params = [match, session_id, limit]
+        else:
+            inner_limit, session_filter = "LIMIT ?", ""
+            params = [match, limit, limit]
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT COALESCE(v.session_id, m.session_id) AS session_id, s.product_name,
+                       CASE h.rowid % 4 WHEN 0 THEN 'content' WHEN 1 THEN 'prompt' ELSE 'message' END AS kind,
+                       COALESCE(v.version_number, mv.version_number) AS version_number,
+                       h.score, v.user_prompt, m.content
+                FROM (
+                    SELECT rowid, rank AS score
+                    FROM search_index
+                    WHERE search_index MATCH ?
+                    ORDER BY rank
+                    {inner_limit}
+                ) AS h
+                LEFT JOIN versions v ON h.rowid % 4 != 2 AND v.id = h.rowid / 4
+                LEFT JOIN chat_messages m ON h.rowid % 4 = 2 AND m.id = h.rowid / 4
+                LEFT JOIN versions mv ON mv.id = m.version_id
+                LEFT JOIN sessions s ON s.session_id = COALESCE(v.session_id, m.session_id)
+                {session_filter}
+                ORDER BY h.score
+                LIMIT ?
+            ''', params).fetchall()
+            
+            results = []
+            for hit_session, product_name, kind, version_number, score, user_prompt, message in rows:
+                if kind == 'content':
+                    text = self._load_content(conn, hit_session, version_number) or ''
+                else:
+                    text = user_prompt if kind == 'prompt' else message
+                results.append({
+                    'session_id': hit_session,
+                    'product_name': product_name,
+                    'kind': kind,
+                    'version_number': version_number,
+                    'snippet': self._snippet(text or '', query),
+                    'score': score
+                })
+        
+        return results
     
     def rollback_to_version(self, session_id: str, target_version: int) -> bool:
         """Rollback to a specific version by deleting all newer versions and related chat messages"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         try:
-            # First, get the timestamp of the target version
-            cursor.execute('''
-                SELECT created_at FROM versions 
-                WHERE session_id = ? AND version_number = ?
-            ''', (session_id, target_version))
-            
-            target_result = cursor.fetchone()
-            if not target_result:
-                conn.close()
-                return False
-            
-            target_timestamp = target_result[0]
-            
-            # Delete all versions newer than the target version
-            cursor.execute('''
-                DELETE FROM versions 
-                WHERE session_id = ? AND version_number > ?
-            ''', (session_id, target_version))
+            with self.transaction(immediate=True) as conn:
+                cursor = conn.cursor()
+                
+                # First, find the target version and the last message of its turn
+                cursor.execute('''
+                    SELECT v.created_at, MAX(m.id)
+                    FROM versions v
+                    LEFT JOIN chat_messages m ON m.version_id = v.id
+                    WHERE v.session_id = ? AND v.version_number = ?
+                    GROUP BY v.id
+                ''', (session_id, target_version))
+                
+                target_result = cursor.fetchone()
+                if not target_result:
+                    return False
+                
+                target_timestamp, last_message_id = target_result
+                
+                # Delete all versions newer than the target version
+                if self.search_enabled:
+                    self._unindex_versions(conn, session_id, target_version)
+                cursor.execute('''
+                    DELETE FROM versions 
+                    WHERE session_id = ? AND version_number > ?
+                ''', (session_id, target_version))
+                
+                # Delete all chat messages after the target version's turn
+                if last_message_id is not None:
+                    cursor.execute('''
+                        DELETE FROM chat_messages 
+                        WHERE session_id = ? AND id > ?
+                    ''', (session_id, last_message_id))
+                else:
+                    # Unlinked legacy turn - fall back to the version timestamp
+                    cursor.execute('''
+                        DELETE FROM chat_messages 
+                        WHERE session_id = ? AND created_at > ?
+                    ''', (session_id, target_timestamp))
+                
+                # The summary may cover deleted turns - it is rebuilt from the remaining ones
+                cursor.execute("DELETE FROM conversation_memory WHERE session_id = ?", (session_id,))
+                
+                # Update session's updated_at timestamp and summary counters
+                cursor.execute('''
+                    UPDATE sessions 
+                    SET updated_at = CURRENT_TIMESTAMP,
+                        version_count = (SELECT COUNT(*) FROM versions WHERE session_id = ?),
+                        latest_version = ?,
+                        last_message_at = (SELECT MAX(created_at) FROM chat_messages WHERE session_id = ?)
+                    WHERE session_id = ?
+                ''', (session_id, target_version, session_id, session_id))
             
-            # Delete all chat messages created after the target version
-            cursor.execute('''
-                DELETE FROM chat_messages 
-                WHERE session_id = ? AND created_at > ?
-            ''', (session_id, target_timestamp))
-            
-            # Update session's updated_at timestamp
-            cursor.execute('''
-                UPDATE sessions 
-                SET updated_at = CURRENT_TIMESTAMP 
-                WHERE session_id = ?
-            ''', (session_id,))
-            
-            conn.commit()
-            conn.close()
             return True
             
         except Exception as e:
-            conn.rollback()
-            conn.close()
             print(f"Error during rollback: {e}")
             return False
+    
+    @staticmethod
+    def _job_from_row(cursor: sqlite3.Cursor, row: tuple) -> Dict:
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+    
+    def create_job(self, session_id: str, kind: str, params: Dict, owner: Optional[str] = None) -> Optional[str]:
+        """Queue a job; returns its id, or None if the session already has an unfinished job.
+
+        owner identifies the process that will run it (see heartbeat_jobs).
+        """
+        job_id = str(uuid.uuid4())
+        try:
+            with self.connection() as conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, session_id, kind, params, owner) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, session_id, kind, json.dumps(params), owner)
+                )
+            return job_id
+        except sqlite3.IntegrityError:
+            return None
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Get a job with its params and result decoded"""
+        with self.connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return self._job_from_row(cursor, row) if row else None
+    
+    def get_active_job(self, session_id: str) -> Optional[Dict]:
+        """Get the session's queued or running job, if any"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "SELECT * FROM jobs WHERE session_id = ? AND status IN ('queued', 'running')",
+                (session_id,)
+            )
+            row = cursor.fetchone()
+            return self._job_from_row(cursor, row) if row else None
+    
+    def start_job(self, job_id: str) -> bool:
+        """Move a queued job to running; False if it is no longer queued"""
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (job_id,))
+            return cursor.rowcount > 0
+    
+    def update_job_progress(self, job_id: str, partial_output: str) -> bool:
+        """Store the output generated so far; also serves as the job's heartbeat.
+
+        Returns False once the job is no longer running, e.g. after it was cancelled.
+        """
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET partial_output = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+                (partial_output, job_id)
+            )
+            return cursor.rowcount > 0
+    
+    @staticmethod
+    def _claim_job(conn: sqlite3.Connection, job_id: str) -> bool:
+        """Mark a running job done inside the transaction that saves its output.
+
+        Cancelling and saving are decided by the same row update, so a cancelled
+        job never writes a version and a saved one can no longer be cancelled.
+        finish_job() adds the result afterwards.
+        """
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'done', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+            (job_id,)
+        )
+        return cursor.rowcount > 0
+    
+    def cancel_job(self, job_id: str) -> bool:
+        """Cancel a queued or running job; False if it has already finished or saved its output"""
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (job_id,))
+            return cursor.rowcount > 0
+    
+    def finish_job(self, job_id: str, status: str, result: Dict = None, error: str = None, error_kind: str = None):
+        """Mark a job done or failed with its result or error; a cancelled job is left as it is"""
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE jobs
+                SET status = ?, result = ?, error = ?, error_kind = ?,
+                    updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND finished_at IS NULL
+            ''', (status, json.dumps(result) if result is not None else None, error, error_kind, job_id))
+    
+    def heartbeat_jobs(self, owner: str) -> int:
+        """Mark the owner's unfinished jobs as alive, whether or not they are producing output"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET updated_at = CURRENT_TIMESTAMP WHERE owner = ? AND status IN ('queued', 'running')",
+                (owner,)
+            )
+            return cursor.rowcount
+    
+    def fail_stale_jobs(self, stale_after_seconds: int) -> int:
+        """Fail unfinished jobs without a heartbeat for stale_after_seconds (their server process is gone).
+
+        Frees the session for a new job - the active-job index allows only one.
+        """
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE jobs
+                SET status = 'failed', error = 'The generation was interrupted.', error_kind = 'interrupted',
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE status IN ('queued', 'running') AND updated_at < datetime('now', ?)
+            ''', (f"-{int(stale_after_seconds)} seconds",))
+            return cursor.rowcount
+    
+    def save_mrd_chunks(self, session_id: str, chunks: List[Dict]):
+        """Store the session's MRD chunks (dicts with heading, content and tokens), replacing earlier ones"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM mrd_chunks WHERE session_id = ?", (session_id,))
+            conn.executemany(
+                "INSERT INTO mrd_chunks (session_id, chunk_index, heading, content, tokens) VALUES (?, ?, ?, ?, ?)",
+                [(session_id, index, chunk['heading'], chunk['content'], chunk['tokens'])
+                 for index, chunk in enumerate(chunks)]
+            )
+    
+    def get_mrd_chunks(self, session_id: str) -> List[Dict]:
+        """The session's MRD chunks in document order; empty if it was created without an MRD"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT heading, content, tokens FROM mrd_chunks WHERE session_id = ? ORDER BY chunk_index",
+                (session_id,)
+            ).fetchall()
+        return [{'heading': row[0], 'content': row[1], 'tokens': row[2]} for row in rows]
+    
+    def get_extracted_text(self, sha256: str) -> Optional[str]:
+        """Cached text extracted from a file with this SHA-256, or None; refreshes its LRU position"""
+        with self.connection() as conn:
+            row = conn.execute("SELECT content FROM extracted_texts WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE extracted_texts SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+        return row[0]
+    
+    def save_extracted_text(self, sha256: str, content: str, max_bytes: int = 200 * 1024 * 1024,
+                            session_id: Optional[str] = None, file_name: Optional[str] = None,
+                            file_size: Optional[int] = None) -> int:
+        """Cache a file's extracted text, then evict least recently used texts beyond max_bytes.
+
+        With session_id the text also becomes that session's MRD document, in the
+        same transaction - so the eviction of a concurrent save cannot remove it
+        before the reference exists. Texts referenced by a session's MRD document
+        are never evicted. Returns the number of evicted texts.
+        """
+        now = time.time()
+        with self.transaction(immediate=True) as conn:
+            conn.execute('''
+                INSERT INTO extracted_texts (sha256, content, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (sha256) DO UPDATE SET last_access = excluded.last_access
+            ''', (sha256, content, len(content.encode("utf-8")), now, now))
+            if session_id is not None:
+                conn.execute('''
+                    INSERT OR REPLACE INTO mrd_documents (session_id, sha256, file_name, file_size)
+                    VALUES (?, ?, ?, ?)
+                ''', (session_id, sha256, file_name, file_size))
+            
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extracted_texts").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            evicted = 0
+            candidates = conn.execute('''
+                SELECT sha256, size FROM extracted_texts t
+                WHERE sha256 != ? AND NOT EXISTS (SELECT 1 FROM mrd_documents d WHERE d.sha256 = t.sha256)
+                ORDER BY last_access ASC
+            ''', (sha256,)).fetchall()
+            for candidate, size in candidates:
+                if total <= max_bytes:
+                    break
+                conn.execute("DELETE FROM extracted_texts WHERE sha256 = ?", (candidate,))
+                total -= size
+                evicted += 1
+            return evicted
+    
+    def get_mrd_document(self, session_id: str) -> Optional[Dict]:
+        """The session's uploaded MRD: sha256, file_name, file_size and the full extracted content"""
+        with self.connection() as conn:
+            row = conn.execute('''
+                SELECT d.sha256, d.file_name, d.file_size, t.content
+                FROM mrd_documents d
+                JOIN extracted_texts t ON t.sha256 = d.sha256
+                WHERE d.session_id = ?
+            ''', (session_id,)).fetchone()
+        if not row:
+            return None
+        return {'sha256': row[0], 'file_name': row[1], 'file_size': row[2], 'content': row[3]}
+    
+    def insert_llm_calls(self, calls: List[Dict]):
+        """Append LLM call records (dicts with LLM_CALL_COLUMNS keys) in one transaction"""
+        columns = ", ".join(LLM_CALL_COLUMNS)
+        placeholders = ", ".join("?" for _ in LLM_CALL_COLUMNS)
+        with self.transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO llm_calls ({columns}) VALUES ({placeholders})",
+                [tuple(call.get(column) for column in LLM_CALL_COLUMNS) for call in calls]
+            )
+    
+    def get_llm_calls(self, since_hours: float = 24, session_id: str = None) -> List[Dict]:
+        """LLM call records of the last since_hours, oldest first"""
+        query = f"SELECT {', '.join(LLM_CALL_COLUMNS)} FROM llm_calls WHERE created_at >= datetime('now', ?)"
+        params = [f"-{float(since_hours)} hours"]
+        if session_id:
+            query += " AND session_id = ?"
+            params.append(session_id)
+        with self.connection() as conn:
+            rows = conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [dict(zip(LLM_CALL_COLUMNS, row)) for row in rows]
+    
+    def get_llm_usage_by_session(self, since_hours: float = 24, limit: int = 50) -> List[Dict]:
+        """Token usage and call counts per session, heaviest first"""
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT c.session_id, s.product_name, COUNT(*),
+                       SUM(CASE WHEN c.status = 'error' THEN 1 ELSE 0 END),
+                       COALESCE(SUM(c.prompt_tokens), 0), COALESCE(SUM(c.completion_tokens), 0)
+                FROM llm_calls c
+                LEFT JOIN sessions s ON s.session_id = c.session_id
+                WHERE c.created_at >= datetime('now', ?) AND c.status != 'cached'
+                GROUP BY c.session_id
+                ORDER BY COALESCE(SUM(c.prompt_tokens), 0) + COALESCE(SUM(c.completion_tokens), 0) DESC
+                LIMIT ?
+            ''', (f"-{float(since_hours)} hours", limit)).fetchall()
+        return [
+            {
+                'session_id': row[0],
+                'product_name': row[1],
+                'calls': row[2],
+                'errors': row[3],
+                'prompt_tokens': row[4],
+                'completion_tokens': row[5],
+                'total_tokens': row[4] + row[5]
+            }
+            for row in rows
+        ]
+    
+    def prune_llm_calls(self, older_than_days: int) -> int:
+        """Delete LLM call records older than the given number of days"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM llm_calls WHERE created_at < datetime('now', ?)",
+                (f"-{int(older_than_days)} days",)
+            )
+            return cursor.rowcount
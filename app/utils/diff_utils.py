@@ -1,6 +1,8 @@
 import difflib
 import re
 
+from .markdown_utils import parse_sections, section_for_line, normalize_heading
+
 def generate_html_diff(old_text: str, new_text: str) -> str:
     """Generate HTML diff with green/red highlighting"""
     
@@ -113,3 +115,104 @@ def get_change_stats(old_text: str, new_text: str) -> dict:
         'lines_changed': added + removed,
         'similarity_ratio': matcher.ratio()
     }
+
+
+def make_line_delta(old_text: str, new_text: str) -> list:
+    """Encode new_text as a compact line delta against old_text.
+
+    The delta is a list of ops: ``[i1, i2]`` copies old lines i1:i2, a string
+    inserts that literal text. Line endings are kept, so apply_line_delta()
+    reproduces new_text byte for byte.
+    """
+    old_lines = old_text.splitlines(keepends=True)
+    new_lines = new_text.splitlines(keepends=True)
+    
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('insert', 'replace'):
+            ops.append(''.join(new_lines[j1:j2]))
+    
+    return ops
+
+def apply_line_delta(old_text: str, ops: list) -> str:
+    """Rebuild the new text from old_text and a delta made by make_line_delta()"""
+    old_lines = old_text.splitlines(keepends=True)
+    
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_lines[op[0]:op[1]])
+    
+    return ''.join(parts)
+
+
+def _section_labeler(text: str):
+    """Return the section headings of a document and a function mapping a line number to its top-level section title"""
+    sections = parse_sections(text)
+    
+    # A single top heading is the document title - group changes by the level below it
+    top_level = min((section['level'] for section in sections), default=1)
+    depth = 1 if sum(1 for section in sections if section['level'] == top_level) == 1 and len(sections) > 1 else 0
+    
+    def label(line_number: int) -> str:
+        section = section_for_line(sections, line_number)
+        if section is None or len(section['path']) <= depth:
+            return "Introduction"
+        return re.sub(r'^\s*\d+(\.\d+)*\.?\s+', '', section['path'][depth]).strip('*_ ')
+    
+    return sections, label
+
+def summarize_changes(old_text: str, new_text: str) -> str:
+    """Summarize changes between two PRD versions per markdown section, without an LLM call.
+
+    Produces e.g. "Modified: Technical Requirements (+12/−3); Added: Risk Assessment".
+    """
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    
+    _, old_label = _section_labeler(old_text)
+    _, new_label = _section_labeler(new_text)
+    old_titles = {normalize_heading(old_label(i)) for i in range(len(old_lines))}
+    new_titles = {normalize_heading(new_label(j)) for j in range(len(new_lines))}
+    
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    
+    # section title -> [lines added, lines removed], in order of first change
+    changes = {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # Blank separator lines shift across the seam when a whole section is inserted
+        # or deleted - counting them would report the neighbouring section as modified
+        for i in range(i1, i2):
+            if old_lines[i].strip():
+                changes.setdefault(old_label(i), [0, 0])[1] += 1
+        for j in range(j1, j2):
+            if new_lines[j].strip():
+                changes.setdefault(new_label(j), [0, 0])[0] += 1
+    
+    modified, added, removed = [], [], []
+    for title, (lines_added, lines_removed) in changes.items():
+        key = normalize_heading(title)
+        if key not in old_titles:
+            added.append(title)
+        elif key not in new_titles:
+            removed.append(title)
+        else:
+            modified.append(f"{title} (+{lines_added}/−{lines_removed})")
+    
+    parts = []
+    if modified:
+        parts.append("Modified: " + ", ".join(modified))
+    if added:
+        parts.append("Added: " + ", ".join(added))
+    if removed:
+        parts.append("Removed: " + ", ".join(removed))
+    
+    return "; ".join(parts) if parts else "No changes"
@@ -1,25 +1,198 @@
-import fitz  # PyMuPDF
-import docx2txt
+import hashlib
+import os
+import threading
+from typing import List, Optional, Tuple
 
-def extract_text_from_file(file) -> str:
-    file_type = file.type
+from .database import PRDDatabase
+
+# PyMuPDF and docx2txt are slow to import, so they are loaded only when a file of that type is uploaded;
+# the same goes for multiprocessing and tempfile, which only PDF extraction needs
+
+class FileTooLargeError(ValueError):
+    """The upload exceeds PDF_MAX_BYTES or PDF_MAX_PAGES"""
+
+def _file_kind(file) -> Optional[str]:
+    """"txt", "pdf" or "docx", or None for an unsupported file"""
     file_name = file.name.lower()
+    if file.type == "text/plain" or file_name.endswith(".txt"):
+        return "txt"
+    elif file_name.endswith(".pdf"):
+        return "pdf"
+    elif file_name.endswith(".docx"):
+        return "docx"
+    return None
+
+def extract_text_from_file(file) -> str:
+    kind = _file_kind(file)
 
-    if file_type == "text/plain" or file_name.endswith(".txt"):
+    if kind == "txt":
         return file.read().decode("utf-8")
 
-    elif file_name.endswith(".pdf"):
+    elif kind == "pdf":
         return extract_text_from_pdf(file)
 
-    elif file_name.endswith(".docx"):
+    elif kind == "docx":
+        import docx2txt
         return docx2txt.process(file)
 
     else:
         return "Unsupported file type."
 
+def file_sha256(file) -> str:
+    """SHA-256 of an upload's bytes, read in 1 MB blocks; leaves the file at its start"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    while True:
+        block = file.read(1024 * 1024)
+        if not block:
+            break
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+def extract_text_cached(db: PRDDatabase, file) -> Tuple[Optional[str], str]:
+    """(sha256, text) of an upload, extracting it only if the same bytes were never extracted before.
+
+    Texts are cached in the database by the SHA-256 of the file, so an MRD that
+    was uploaded in any earlier session skips PyMuPDF/docx2txt. The cache is
+    bounded by EXTRACTION_CACHE_MAX_MB. Unsupported files are not cached and
+    get sha256 None.
+    """
+    if _file_kind(file) is None:
+        return None, extract_text_from_file(file)
+    sha256 = file_sha256(file)
+    text = db.get_extracted_text(sha256)
+    if text is None:
+        text = extract_text_from_file(file)
+        _save_extracted_text(db, sha256, text)
+    return sha256, text
+
+def save_session_mrd(db: PRDDatabase, session_id: str, sha256: str, text: str,
+                     file_name: Optional[str] = None, file_size: Optional[int] = None):
+    """Make an extracted text (from extract_text_cached) the session's MRD document.
+
+    The text is written again together with the reference, so it is stored even
+    if the cache evicted it since it was extracted.
+    """
+    _save_extracted_text(db, sha256, text, session_id=session_id, file_name=file_name, file_size=file_size)
+
+def _save_extracted_text(db: PRDDatabase, sha256: str, text: str, **document):
+    evicted = db.save_extracted_text(
+        sha256, text, max_bytes=int(os.environ.get("EXTRACTION_CACHE_MAX_MB", 200)) * 1024 * 1024, **document
+    )
+    if evicted:
+        print(f"🧹 Evicted {evicted} cached MRD texts")
+
+def _max_bytes() -> int:
+    return int(os.environ.get("PDF_MAX_BYTES", 100 * 1024 * 1024))
+
+def _spool_to_disk(file) -> str:
+    """Copy an upload to a temporary file in 1 MB blocks and return its path.
+
+    Stops as soon as PDF_MAX_BYTES is exceeded, so an oversized upload is never
+    held in memory or on disk in full.
+    """
+    import tempfile
+    limit = _max_bytes()
+    if hasattr(file, "seek"):
+        file.seek(0)
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="mrd-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            copied = 0
+            while True:
+                block = file.read(1024 * 1024)
+                if not block:
+                    break
+                copied += len(block)
+                if copied > limit:
+                    raise FileTooLargeError(f"The PDF is larger than the upload limit of {limit:,} bytes")
+                out.write(block)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def _extract_pages(path: str, start: int, stop: int) -> str:
+    """Text of pages [start, stop) - runs in a worker process, so it opens the file itself"""
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return "".join([doc[number].get_text() for number in range(start, stop)])
+
+def _page_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """A few ranges per worker, so one slow range (scans, big tables) does not hold up the rest"""
+    size = max(8, -(-page_count // (workers * 4)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+_pool = None  # Optional[ProcessPoolExecutor]
+_pool_lock = threading.Lock()
+
+def _extract_workers() -> int:
+    return int(os.environ.get("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+
+def _get_pool():
+    """Process pool shared by all extractions; created on first use.
+
+    Workers are spawned rather than forked - forking the multi-threaded
+    Streamlit server can deadlock the child.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=_extract_workers(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
 def extract_text_from_pdf(file) -> str:
-    text = ""
-    with fitz.open(stream=file.read(), filetype="pdf") as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+    """Text of all pages of a PDF upload.
+
+    The upload is read from disk (spooled to a temporary file first unless it
+    already is one, see batch.LocalFile), never as one in-memory copy. Documents
+    of at least PDF_PARALLEL_MIN_PAGES pages are extracted in page ranges on a
+    process pool of PDF_EXTRACT_WORKERS; PDF_MAX_BYTES and PDF_MAX_PAGES reject
+    uploads that would tie up the server.
+    """
+    import fitz  # PyMuPDF
+
+    path = getattr(file, "path", None)
+    if path:
+        limit = _max_bytes()
+        if os.path.getsize(path) > limit:
+            raise FileTooLargeError(f"The PDF is larger than the upload limit of {limit:,} bytes")
+        spooled = None
+    else:
+        path = spooled = _spool_to_disk(file)
+
+    try:
+        # Opening only reads the page tree, not the page contents
+        with fitz.open(path) as doc:
+            page_count = doc.page_count
+        max_pages = int(os.environ.get("PDF_MAX_PAGES", 2000))
+        if page_count > max_pages:
+            raise FileTooLargeError(f"The PDF has {page_count} pages, the limit is {max_pages}")
+
+        workers = _extract_workers()
+        if workers <= 1 or page_count < int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 64)):
+            # Starting worker processes costs more than extracting a short document
+            return _extract_pages(path, 0, page_count)
+
+        from concurrent.futures.process import BrokenProcessPool
+        ranges = _page_ranges(page_count, workers)
+        try:
+            parts = list(_get_pool().map(_extract_pages, [path] * len(ranges), *zip(*ranges)))
+        except BrokenProcessPool:
+            # A worker died (e.g. MuPDF crashed on a malformed file) - the next upload gets a fresh pool
+            _reset_pool()
+            raise
+        return "".join(parts)
+    finally:
+        if spooled:
+            os.remove(spooled)
@@ -0,0 +1,375 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generator, Optional, Tuple
+
+from .conversation_memory import build_conversation_context, schedule_conversation_memory_update
+from .database import PRDDatabase
+from .diff_utils import summarize_changes
+from .llm_scheduler import LLMCancelled, LLMError
+from .llm_utils import (
+    stream_initial_prd, stream_interactive_prd_update, generate_initial_prd_parallel, generate_prd_edits,
+    generate_change_summary, condense_mrd, PRD_SECTIONS
+)
+from .markdown_utils import apply_prd_edits
+from .mrd_index import MRDIndex, count_tokens
+from .telemetry import llm_session
+
+class JobCancelled(LLMCancelled):
+    """Raised inside a job's worker once the job has been cancelled.
+
+    Handlers catch LLMCancelled, which also covers requests that llm_utils aborted
+    on the job's cancel event.
+    """
+
+class JobAlreadyRunning(RuntimeError):
+    """The session already has an unfinished job, so the new one was not queued"""
+
+    def __init__(self, job_id: str, kind: str):
+        super().__init__(f"A {kind} job is already running for this session")
+        self.job_id = job_id
+        self.kind = kind
+
+def collect_stream(stream: Generator[str, None, None], report_progress: Callable[[str], None],
+                   cancelled: Optional[threading.Event] = None, interval: float = 0.25) -> str:
+    """Consume a PRD token stream, reporting the text generated so far at most every interval seconds.
+
+    Raises JobCancelled as soon as cancelled is set; the stream is closed, which
+    aborts the HTTP request instead of paying for the rest of the document.
+    """
+    parts = []
+    last_report = 0.0
+    try:
+        for delta in stream:
+            if cancelled is not None and cancelled.is_set():
+                raise JobCancelled()
+            parts.append(delta)
+            now = time.monotonic()
+            if now - last_report >= interval:
+                report_progress(''.join(parts))
+                last_report = now
+    finally:
+        stream.close()
+    return ''.join(parts).strip()
+
+def try_patch_update(current_prd: str, user_request: str, product_name: str, context: str = "",
+                     use_cache: bool = False, cancelled: Optional[threading.Event] = None):
+    """Apply the request as section edits; returns the patched PRD or None to fall back to full regeneration.
+
+    LLMError is raised - when the API itself fails, a full regeneration would fail too.
+    Setting cancelled aborts the request and raises LLMCancelled.
+    """
+    if os.environ.get("PRD_EDIT_MODE", "patch") != "patch":
+        return None
+    try:
+        edits = generate_prd_edits(current_prd, user_request, product_name, context, use_cache=use_cache,
+                                   cancelled=cancelled)
+        if edits is None:
+            return None
+        return apply_prd_edits(current_prd, edits)
+    except (LLMError, LLMCancelled):
+        raise
+    except Exception as e:
+        print(f"Patch edit failed, falling back to full regeneration: {e}")
+        return None
+
+def polish_change_summary(db: PRDDatabase, session_id: str, version_number: int, old_prd: str, new_prd: str,
+                          local_summary: str, use_cache: bool = False):
+    """Rewrite a version's change description with the LLM - runs in a background thread after saving"""
+    with llm_session(session_id):
+        summary = generate_change_summary(old_prd, new_prd, local_summary, use_cache=use_cache)
+    if summary and summary != "Unable to generate change summary":
+        db.update_change_description(session_id, version_number, summary)
+
+def mrd_context_for_request(db: PRDDatabase, session_id: str, user_request: str) -> str:
+    """The session's MRD excerpts most relevant to a chat request, within MRD_CONTEXT_TOKENS"""
+    chunks = db.get_mrd_chunks(session_id)
+    if not chunks:
+        # E.g. the initial generation was cancelled before indexing - the uploaded MRD is still stored
+        document = db.get_mrd_document(session_id)
+        if not document:
+            return ""
+        chunks = MRDIndex.from_text(document['content'], int(os.environ.get("MRD_CHUNK_TOKENS", 400))).chunks
+        db.save_mrd_chunks(session_id, chunks)
+    excerpts = MRDIndex(chunks).context(
+        user_request,
+        budget_tokens=int(os.environ.get("MRD_CONTEXT_TOKENS", 2000)),
+        k=int(os.environ.get("MRD_CONTEXT_CHUNKS", 8))
+    )
+    return f"Relevant excerpts from the MRD:\n{excerpts}" if excerpts else ""
+
+def prepare_mrd_prompt(mrd_content: str, product_name: str,
+                       on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[MRDIndex, str, Optional[Dict]]:
+    """Chunk and index the MRD and fit it into the initial PRD prompt.
+
+    Returns (index, MRD text for the prompt, per-section excerpts or None). An MRD
+    over MRD_PROMPT_TOKENS is condensed by map-reduce (MRD_OVERSIZED=summarize,
+    the default) or trimmed to the chunks covering each PRD section best
+    (MRD_OVERSIZED=retrieve). on_progress follows the map phase.
+    """
+    index = MRDIndex.from_text(mrd_content, int(os.environ.get("MRD_CHUNK_TOKENS", 400)))
+    budget = int(os.environ.get("MRD_PROMPT_TOKENS", 12000))
+    # The only place the MRD is fitted to the budget - the generators take mrd_prompt as it is
+    if count_tokens(mrd_content) <= budget:
+        return index, mrd_content, None
+    if os.environ.get("MRD_OVERSIZED", "summarize") == "retrieve":
+        return index, index.overview(PRD_SECTIONS, budget), {title: index.overview([title], budget) for title in PRD_SECTIONS}
+    return index, condense_mrd(mrd_content, product_name, budget, on_progress=on_progress), None
+
+def run_initial_prd(db: PRDDatabase, job: Dict, report_progress: Callable[[str], None],
+                    cancelled: threading.Event) -> Dict:
+    """Generate the first PRD version of a session from its MRD"""
+    params = job['params']
+    product_name = params['product_name']
+    mrd_content = params.get('mrd_content')
+    if mrd_content is None:
+        # The job references the session's uploaded MRD instead of carrying a copy in its params
+        document = db.get_mrd_document(job['session_id'])
+        mrd_content = document['content'] if document else ""
+    additional_context = params.get('additional_context', "")
+
+    def check_cancelled(done: int, total: int):
+        if cancelled.is_set():
+            raise JobCancelled()
+
+    # The chunks are kept for retrieval in later chat requests
+    index, mrd_prompt, section_mrd = prepare_mrd_prompt(mrd_content, product_name, on_progress=check_cancelled)
+    db.save_mrd_chunks(job['session_id'], index.chunks)
+
+    missing_sections = []
+    if params.get('mode') == "parallel":
+        # Sections are generated concurrently and reported as they complete
+        initial_prd, missing_sections = generate_initial_prd_parallel(
+            mrd_prompt, product_name, additional_context,
+            max_workers=params.get('section_workers', 4),
+            on_progress=report_progress,
+            use_cache=params.get('use_cache', False),
+            section_mrd=section_mrd,
+            cancelled=cancelled
+        )
+    else:
+        initial_prd = collect_stream(
+            stream_initial_prd(mrd_prompt, product_name, additional_context, use_cache=params.get('use_cache', False),
+                               cancelled=cancelled),
+            report_progress,
+            cancelled
+        )
+    if not initial_prd:
+        raise LLMError("unknown", "The AI returned an empty document.")
+
+    initial_prompt = f"Product: {product_name}"
+    if mrd_content:
+        initial_prompt += f"\nMRD Content: {mrd_content[:200]}..."
+    if additional_context:
+        initial_prompt += f"\nAdditional Context: {additional_context}"
+
+    assistant_message = f"I've generated an initial PRD for '{product_name}'. You can see it in the preview panel. How would you like to modify it?"
+    if missing_sections:
+        assistant_message += (
+            f"\n\nThese sections could not be generated and were left out: {', '.join(missing_sections)}. "
+            "Ask me to write them."
+        )
+    version_number = db.save_version(
+        job['session_id'],
+        initial_prd,
+        "Initial PRD",
+        "Generated initial PRD from MRD and context",
+        initial_prompt,
+        assistant_message=assistant_message,
+        job_id=job['id']
+    )
+    if version_number is None:
+        raise JobCancelled()
+    return {'version_number': version_number, 'assistant_message': assistant_message}
+
+def run_prd_update(db: PRDDatabase, job: Dict, report_progress: Callable[[str], None],
+                   cancelled: threading.Event) -> Dict:
+    """Apply a chat request to the session's latest PRD and save the turn"""
+    params = job['params']
+    session_id = job['session_id']
+    user_request = params['user_request']
+    use_cache = params.get('use_cache', False)
+    old_prd = db.get_latest_version(session_id)['content']
+
+    try:
+        # Earlier turns (rolling summary + latest raw turns) and only the parts of
+        # the MRD relevant to this request, so the prompt stays bounded
+        context = "\n\n".join(part for part in (
+            build_conversation_context(db, session_id),
+            mrd_context_for_request(db, session_id, user_request)
+        ) if part)
+
+        # Small changes come back as section edits applied locally
+        updated_prd = try_patch_update(old_prd, user_request, params['product_name'], context,
+                                       use_cache=use_cache, cancelled=cancelled)
+        if updated_prd is None:
+            updated_prd = collect_stream(
+                stream_interactive_prd_update(old_prd, user_request, params['product_name'], context,
+                                              use_cache=use_cache, cancelled=cancelled),
+                report_progress,
+                cancelled
+            )
+        if not updated_prd:
+            raise LLMError("unknown", "The AI returned an empty document.")
+    except LLMCancelled:
+        raise
+    except Exception as e:
+        if cancelled.is_set():
+            raise JobCancelled() from e
+        # Failed requests never become a PRD version, but the turn stays in the chat
+        error_message = e.user_message if isinstance(e, LLMError) else str(e)
+        db.save_chat_message(session_id, "user", user_request)
+        db.save_chat_message(session_id, "assistant", f"Sorry, I encountered an error: {error_message}")
+        raise
+
+    # Summarize changes locally from the line diff
+    change_summary = summarize_changes(old_prd, updated_prd)
+
+    # Save user message, new version and assistant response in one transaction
+    assistant_message = f"I've updated the PRD based on your request. Changes: {change_summary}"
+    version_number = db.commit_turn(session_id, user_request, updated_prd, change_summary, assistant_message,
+                                    job_id=job['id'])
+    if version_number is None:
+        raise JobCancelled()
+
+    # Fold older turns into the conversation summary in the background
+    schedule_conversation_memory_update(db, session_id, params['product_name'], use_cache=use_cache)
+
+    # Optional LLM polish of the stored description, off the job's critical path
+    if os.environ.get("PRD_SUMMARY_POLISH", "false").lower() == "true":
+        threading.Thread(
+            target=polish_change_summary,
+            args=(db, session_id, version_number, old_prd, updated_prd, change_summary),
+            kwargs={"use_cache": use_cache},
+            daemon=True
+        ).start()
+
+    return {'version_number': version_number, 'assistant_message': assistant_message}
+
+JOB_HANDLERS = {
+    "initial_prd": run_initial_prd,
+    "prd_update": run_prd_update,
+}
+
+class JobManager:
+    """Runs PRD generation jobs on a thread pool, persisting their state in the jobs table.
+
+    The Streamlit script only submits a job and polls its row, so a generation
+    keeps running - and its result is saved - across reruns, session switches
+    and closed tabs. Partial output is written at most every progress_interval
+    seconds for the preview. cancel() stops a job: the worker notices it at the
+    next token or progress report, and nothing of a cancelled job is saved.
+
+    Every heartbeat_interval seconds the manager marks all jobs it owns as alive
+    (also ones waiting on a non-streamed call) and fails jobs of any process
+    that has sent no heartbeat for stale_after_seconds - such a process died
+    or was restarted, and its jobs would otherwise block their sessions.
+    """
+
+    def __init__(self, db: PRDDatabase, max_workers: int = 8, progress_interval: float = 0.5,
+                 heartbeat_interval: float = 15.0, stale_after_seconds: int = 120):
+        self.db = db
+        self.progress_interval = progress_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after_seconds = stale_after_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prd-job")
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._fail_stale_jobs()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="prd-job-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def _fail_stale_jobs(self):
+        stale = self.db.fail_stale_jobs(self.stale_after_seconds)
+        if stale:
+            print(f"⚠️ Marked {stale} interrupted jobs as failed")
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.db.heartbeat_jobs(self.owner)
+                self._fail_stale_jobs()
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def submit(self, session_id: str, kind: str, params: Dict) -> str:
+        """Queue a job and return its id.
+
+        Raises JobAlreadyRunning (carrying the other job's id) if the session
+        already has an unfinished job - the request is not queued behind it.
+        """
+        for _ in range(5):
+            job_id = self.db.create_job(session_id, kind, params, owner=self.owner)
+            if job_id:
+                self._executor.submit(self._run, job_id)
+                return job_id
+            active = self.db.get_active_job(session_id)
+            if active:
+                raise JobAlreadyRunning(active['id'], active['kind'])
+            # The other job finished in the meantime - try again
+        raise RuntimeError(f"Could not queue a {kind} job for session {session_id}")
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        return self.db.get_job(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; False if it already finished (its result is then kept)"""
+        if not self.db.cancel_job(job_id):
+            return False
+        with self._lock:
+            cancelled = self._cancel_events.get(job_id)
+        if cancelled:
+            cancelled.set()
+        return True
+
+    def _run(self, job_id: str):
+        cancelled = threading.Event()
+        with self._lock:
+            self._cancel_events[job_id] = cancelled
+        try:
+            self._execute(job_id, cancelled)
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+
+    def _execute(self, job_id: str, cancelled: threading.Event):
+        job = self.db.get_job(job_id)
+        if not job or not self.db.start_job(job_id):
+            return
+
+        last_report = [0.0]
+
+        def report_progress(partial_output: str):
+            if cancelled.is_set():
+                raise JobCancelled()
+            now = time.monotonic()
+            if now - last_report[0] >= self.progress_interval:
+                # The row is no longer running if the job was cancelled from another process
+                if not self.db.update_job_progress(job_id, partial_output):
+                    cancelled.set()
+                    raise JobCancelled()
+                last_report[0] = now
+
+        try:
+            with llm_session(job['session_id']):
+                result = JOB_HANDLERS[job['kind']](self.db, job, report_progress, cancelled)
+        except LLMCancelled:
+            print(f"Job {job_id} ({job['kind']}) cancelled")
+        except LLMError as e:
+            print(f"Job {job_id} ({job['kind']}) failed: {e.kind}: {e}")
+            self.db.finish_job(job_id, "failed", error=e.user_message, error_kind=e.kind)
+        except Exception as e:
+            print(f"Job {job_id} ({job['kind']}) failed: {e}")
+            self.db.finish_job(job_id, "failed", error=str(e), error_kind="error")
+        else:
+            self.db.finish_job(job_id, "done", result=result)
+
+    def shutdown(self, wait: bool = True):
+        self._stop.set()
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from .llm_scheduler import LLMError, estimate_tokens
+from .markdown_utils import parse_sections
+
+# Model roles used by llm_utils: "main" for full documents, "fast" for edits and short tasks
+DEFAULT_MODELS = {
+    "openai": {"main": "gpt-4o", "fast": "gpt-4o-mini"},
+    "stub": {"main": "stub-main", "fast": "stub-fast"},
+}
+
+class Completion(NamedTuple):
+    """A complete response with the token usage reported by the backend (None if it reported none)"""
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+class TextStream:
+    """Iterator over the text deltas of a streamed completion; close() releases the underlying request.
+
+    prompt_tokens and completion_tokens are set once the backend reports usage,
+    normally with the last chunk.
+    """
+
+    def __init__(self, deltas: Iterator[str], on_close=None):
+        self._deltas = deltas
+        self._on_close = on_close
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def __iter__(self):
+        return self._deltas
+
+    def close(self):
+        if self._on_close:
+            self._on_close()
+            self._on_close = None
+
+class LLMProvider(ABC):
+    """Backend for chat completions.
+
+    complete() returns the whole response as a Completion, open_stream() starts a streamed
+    one and returns a TextStream. Both raise LLMError or an exception that
+    classify_error() maps to one.
+    """
+
+    name = ""
+
+    def model(self, role: str) -> str:
+        """Model for a role, overridable with LLM_MODEL_<ROLE> (e.g. LLM_MODEL_FAST)"""
+        return os.environ.get(f"LLM_MODEL_{role.upper()}", DEFAULT_MODELS[self.name][role])
+
+    @abstractmethod
+    def complete(self, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> Completion:
+        """The whole response to a chat completion request"""
+
+    @abstractmethod
+    def open_stream(self, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> TextStream:
+        """Send a streamed chat completion request"""
+
+    def classify_error(self, e: Exception) -> LLMError:
+        return LLMError("unknown", str(e))
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions API; the client is created on first use"""
+
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                api_key = self.api_key or os.environ.get("OPENAI_API_KEY")
+                if not api_key:
+                    print("ERROR: OPENAI_API_KEY not found in environment variables!")
+                    print("Please set your OpenAI API key in the .env file")
+                    raise LLMError("config", "OPENAI_API_KEY is not set")
+
+                from openai import OpenAI
+                # Retries are done by the scheduler, which also knows about the rate limits
+                self._client = OpenAI(api_key=api_key, max_retries=0)
+            return self._client
+
+    def complete(self, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> Completion:
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **extra
+        )
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None
+        )
+
+    def open_stream(self, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> TextStream:
+        # The request is sent here, so the scheduler can retry opening it
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            # The usage arrives in an extra final chunk without choices
+            stream_options={"include_usage": True},
+            **extra
+        )
+
+        def deltas():
+            for chunk in stream:
+                if chunk.usage:
+                    text_stream.prompt_tokens = chunk.usage.prompt_tokens
+                    text_stream.completion_tokens = chunk.usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        text_stream = TextStream(deltas(), stream.close)
+        return text_stream
+
+    def classify_error(self, e: Exception) -> LLMError:
+        # openai is already imported by the time a request has failed
+        from openai import (
+            RateLimitError, APITimeoutError, APIConnectionError, InternalServerError,
+            AuthenticationError, PermissionDeniedError, BadRequestError
+        )
+
+        retry_after = None
+        response = getattr(e, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+
+        if isinstance(e, RateLimitError):
+            kind = "quota" if getattr(e, "code", None) == "insufficient_quota" else "rate_limit"
+        elif isinstance(e, APITimeoutError):
+            kind = "timeout"
+        elif isinstance(e, APIConnectionError):
+            kind = "connection"
+        elif isinstance(e, InternalServerError):
+            kind = "server"
+        elif isinstance(e, (AuthenticationError, PermissionDeniedError)):
+            kind = "auth"
+        elif isinstance(e, BadRequestError):
+            kind = "bad_request"
+        else:
+            kind = "unknown"
+        return LLMError(kind, str(e), retry_after)
+
+class StubProvider(LLMProvider):
+    """Offline, deterministic backend for benchmarks and load tests.
+
+    Responses depend only on the request: the stub writes a markdown document
+    with the sections named in the prompt (its headings, or a numbered list),
+    each with filler text seeded by the section title, and rewrites one
+    request-dependent section - so consecutive PRD updates produce small,
+    realistic diffs. JSON requests get a single section "replace" edit.
+
+    latency is the time to the first token, tokens_per_second the generation
+    speed (a token is taken as 4 characters), and error_rate the probability
+    that a request fails with LLMError(error_kind).
+    """
+
+    name = "stub"
+
+    FILLER = (
+        "the product team will validate scope with customers and refine requirements for the next release "
+        "while engineering tracks performance reliability security and cost against agreed service levels"
+    ).split()
+
+    def __init__(self, latency: float = 0.2, tokens_per_second: float = 80.0, words_per_section: int = 60,
+                 error_rate: float = 0.0, error_kind: str = "rate_limit", seed: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.words_per_section = words_per_section
+        self.error_rate = error_rate
+        self.error_kind = error_kind
+        self._errors = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(*parts) -> int:
+        return int(hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16], 16)
+
+    def _maybe_fail(self):
+        with self._lock:
+            failed = self._errors.random() < self.error_rate
+        if failed:
+            raise LLMError(self.error_kind, f"Injected {self.error_kind} error")
+
+    def _paragraph(self, *seed) -> str:
+        rng = random.Random(self._digest(*seed))
+        words = [rng.choice(self.FILLER) for _ in range(self.words_per_section)]
+        return " ".join(words).capitalize() + "."
+
+    @staticmethod
+    def _sections(prompt: str) -> List[Dict]:
+        """Sections (level, title, path) the response should have"""
+        sections = parse_sections(prompt)
+        if sections:
+            return sections
+        titles = re.findall(r'^\s*\d+\.\s+(.+?)\s*$', prompt, re.MULTILINE) or ["Overview", "Details"]
+        return [{'level': 2, 'title': title, 'path': [title]} for title in titles]
+
+    def _respond(self, model: str, messages: List[Dict], max_tokens: int, json_mode: bool) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        sections = self._sections(prompt)
+        changed = self._digest(model, messages) % len(sections)
+
+        if json_mode:
+            return json.dumps({"edits": [{
+                "op": "replace",
+                "path": sections[changed]['path'],
+                "content": self._paragraph("edit", model, messages)
+            }]})
+
+        parts = []
+        for index, section in enumerate(sections):
+            if index == changed:
+                body = self._paragraph("changed", model, messages)
+            else:
+                body = self._paragraph(section['title'])
+            parts.append(f"{'#' * section['level']} {section['title']}\n\n{body}")
+        return "\n\n".join(parts)[:max_tokens * 4]
+
+    def complete(self, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> Completion:
+        self._maybe_fail()
+        json_mode = (extra.get("response_format") or {}).get("type") == "json_object"
+        text = self._respond(model, messages, max_tokens, json_mode)
+        time.sleep(self.latency + len(text) / 4 / self.tokens_per_second)
+        return Completion(text, estimate_tokens(messages, 0), len(text) // 4)
+
+    def open_stream(self, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> TextStream:
+        self._maybe_fail()
+        json_mode = (extra.get("response_format") or {}).get("type") == "json_object"
+        text = self._respond(model, messages, max_tokens, json_mode)
+        closed = threading.Event()
+
+        def deltas():
+            # Closing the stream cuts the wait for the first token short, like aborting the HTTP request
+            if closed.wait(self.latency):
+                return
+            # Chunks of roughly one token, like the real API
+            for start in range(0, len(text), 4):
+                if closed.is_set():
+                    return
+                time.sleep(1 / self.tokens_per_second)
+                yield text[start:start + 4]
+            text_stream.prompt_tokens = estimate_tokens(messages, 0)
+            text_stream.completion_tokens = len(text) // 4
+
+        text_stream = TextStream(deltas(), closed.set)
+        return text_stream
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider() -> LLMProvider:
+    """Process-wide provider selected by LLM_PROVIDER ("openai" or "stub")"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            name = os.environ.get("LLM_PROVIDER", "openai").lower()
+            if name == "stub":
+                _provider = StubProvider(
+                    latency=float(os.environ.get("LLM_STUB_LATENCY_MS", 200)) / 1000,
+                    tokens_per_second=float(os.environ.get("LLM_STUB_TOKENS_PER_SECOND", 80)),
+                    error_rate=float(os.environ.get("LLM_STUB_ERROR_RATE", 0)),
+                    error_kind=os.environ.get("LLM_STUB_ERROR_KIND", "rate_limit"),
+                    seed=int(os.environ.get("LLM_STUB_SEED", 0))
+                )
+            elif name == "openai":
+                _provider = OpenAIProvider()
+            else:
+                raise ValueError(f"Unknown LLM_PROVIDER: {name}")
+        return _provider
@@ -0,0 +1,204 @@
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+class LLMError(Exception):
+    """Typed failure of an LLM request.
+
+    kind is one of "rate_limit", "quota", "timeout", "connection", "server",
+    "auth", "bad_request", "config" or "unknown"; retry_after is the delay in
+    seconds the API asked for, if any.
+    """
+
+    RETRYABLE_KINDS = ("rate_limit", "timeout", "connection", "server")
+
+    def __init__(self, kind: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in self.RETRYABLE_KINDS
+
+    @property
+    def user_message(self) -> str:
+        """Short explanation suitable for the chat panel"""
+        if self.kind == "rate_limit":
+            return "The AI service is busy right now. Please try again in a moment."
+        if self.kind == "quota":
+            return "The OpenAI account has run out of quota."
+        if self.kind in ("timeout", "connection", "server"):
+            return "The AI service is not responding. Please try again."
+        if self.kind == "auth":
+            return "The OpenAI API key was rejected."
+        if self.kind == "config":
+            return "The OpenAI API key is not configured. Please set OPENAI_API_KEY in the .env file."
+        return f"The AI request failed: {self.message}"
+
+class LLMCancelled(Exception):
+    """Raised when a request was aborted because its caller cancelled it"""
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at capacity per minute"""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket (going into debt if needed) and return how long to wait before using it"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class LLMScheduler:
+    """Admission control for LLM requests.
+
+    Every request waits for a slot in the bounded concurrency pool and for room in
+    the per-model requests-per-minute and tokens-per-minute buckets, so bursts are
+    queued instead of hitting the API's limits. Retryable failures are retried with
+    exponential backoff and full jitter, honouring the API's retry-after hint.
+    Errors reach the caller as LLMError; a request whose cancelled event is set
+    stops waiting (for a slot, capacity or a retry) and raises LLMCancelled.
+    """
+
+    def __init__(self, requests_per_minute: int = 500, tokens_per_minute: int = 200000,
+                 max_concurrency: int = 8, max_retries: int = 4,
+                 base_delay: float = 1.0, max_delay: float = 30.0,
+                 classify_error: Optional[Callable[[Exception], LLMError]] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify_error = classify_error or (lambda e: LLMError("unknown", str(e)))
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._buckets: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, model: str) -> tuple:
+        """OpenAI limits are per model, so each model gets its own pair of buckets"""
+        with self._lock:
+            if model not in self._buckets:
+                self._buckets[model] = (TokenBucket(self.requests_per_minute), TokenBucket(self.tokens_per_minute))
+            return self._buckets[model]
+
+    @staticmethod
+    def _sleep(delay: float, cancelled: Optional[threading.Event]):
+        """Sleep for delay seconds, raising LLMCancelled as soon as cancelled is set"""
+        if cancelled is None:
+            time.sleep(delay)
+        elif cancelled.wait(delay):
+            raise LLMCancelled()
+
+    def _acquire_slot(self, cancelled: Optional[threading.Event]):
+        if cancelled is None:
+            self._slots.acquire()
+            return
+        while not self._slots.acquire(timeout=0.1):
+            if cancelled.is_set():
+                raise LLMCancelled()
+
+    def _wait_for_capacity(self, model: str, estimated_tokens: int, cancelled: Optional[threading.Event] = None):
+        requests, tokens = self._buckets_for(model)
+        delay = max(requests.reserve(1), tokens.reserve(estimated_tokens))
+        if delay > 0:
+            self._sleep(delay, cancelled)
+
+    def _backoff(self, attempt: int, error: LLMError) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if error.retry_after:
+            delay = max(delay, error.retry_after)
+        return delay
+
+    def _attempts(self, model: str, estimated_tokens: int, call: Callable[[], T],
+                  on_retry: Optional[Callable[[LLMError], None]] = None,
+                  cancelled: Optional[threading.Event] = None) -> T:
+        """Run call until it succeeds or fails permanently; the caller holds a concurrency slot"""
+        for attempt in range(self.max_retries + 1):
+            if cancelled is not None and cancelled.is_set():
+                raise LLMCancelled()
+            self._wait_for_capacity(model, estimated_tokens, cancelled)
+            try:
+                return call()
+            except Exception as e:
+                error = e if isinstance(e, LLMError) else self.classify_error(e)
+                if not error.retryable or attempt == self.max_retries:
+                    raise error from e
+                delay = self._backoff(attempt, error)
+                print(f"LLM request to {model} failed ({error.kind}), retrying in {delay:.1f}s")
+                if on_retry:
+                    on_retry(error)
+                self._sleep(delay, cancelled)
+
+    def run(self, model: str, estimated_tokens: int, call: Callable[[], T],
+            on_retry: Optional[Callable[[LLMError], None]] = None,
+            cancelled: Optional[threading.Event] = None) -> T:
+        """Run a single request under the limits; on_retry is called with each error that is retried"""
+        self._acquire_slot(cancelled)
+        try:
+            return self._attempts(model, estimated_tokens, call, on_retry, cancelled)
+        finally:
+            self._slots.release()
+
+    def stream(self, model: str, estimated_tokens: int, open_stream: Callable[[], T],
+               on_retry: Optional[Callable[[LLMError], None]] = None,
+               cancelled: Optional[threading.Event] = None):
+        """Open a streaming request under the limits.
+
+        Only opening the stream is retried - once chunks flow a failure is the caller's.
+        Returns (stream, release); release() must be called when the stream is done to
+        free the concurrency slot.
+        """
+        self._acquire_slot(cancelled)
+        try:
+            stream = self._attempts(model, estimated_tokens, open_stream, on_retry, cancelled)
+        except BaseException:
+            self._slots.release()
+            raise
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._slots.release()
+
+        return stream, release
+
+def estimate_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """Rough request cost as counted against TPM limits: ~4 characters per prompt token plus max_tokens"""
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(classify_error: Optional[Callable[[Exception], LLMError]] = None) -> LLMScheduler:
+    """Process-wide scheduler, configured from LLM_* environment variables"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                requests_per_minute=int(os.environ.get("LLM_REQUESTS_PER_MINUTE", 500)),
+                tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", 200000)),
+                max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+                max_retries=int(os.environ.get("LLM_MAX_RETRIES", 4)),
+                classify_error=classify_error
+            )
+        return _scheduler
@@ -1,43 +1,342 @@
+import contextvars
+import json
 import os
-import sys
-from openai import OpenAI, RateLimitError
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+from .llm_cache import get_llm_cache
+from .llm_providers import get_provider
+from .llm_scheduler import LLMCancelled, LLMError, get_scheduler, estimate_tokens
+from .mrd_index import count_tokens, split_overlapping
+from .telemetry import record_llm_call
 
-# Check for required environment variables
-openai_api_key = os.environ.get("OPENAI_API_KEY")
-if not openai_api_key:
-    print("ERROR: OPENAI_API_KEY not found in environment variables!")
-    print("Please set your OpenAI API key in the .env file")
-    sys.exit(1)
+# Sections of a generated PRD, in document order
+PRD_SECTIONS = [
+    "Executive Summary",
+    "Product Overview",
+    "User Stories & Requirements",
+    "Technical Requirements",
+    "Success Metrics",
+    "Timeline & Milestones",
+    "Risk Assessment",
+]
 
-client = OpenAI(api_key=openai_api_key)
+def _chat_completion(function: str, role: str, messages: List[Dict], temperature: float, max_tokens: int,
+                     use_cache: bool = False, cancelled: Optional[threading.Event] = None, **extra) -> str:
+    """Run a chat completion on the configured provider's model for role ("main" or "fast").
 
-def generate_prd_section(section_title: str, mrd_text: str, product_name: str) -> str:
-    """Generate a specific section of PRD based on MRD content (legacy function)"""
+    Goes through the scheduler and is served from the response cache when use_cache
+    is set. The call is recorded in the LLM telemetry under function. Raises LLMError.
+    With cancelled the response is streamed instead, and setting the event closes
+    the HTTP request - also while it is still queued or waiting for its first
+    token - and raises LLMCancelled.
+    """
+    if cancelled is not None:
+        if cancelled.is_set():
+            raise LLMCancelled()
+        stream = _stream_completion(function, role, messages, temperature, max_tokens, use_cache, cancelled, **extra)
+        parts = []
+        try:
+            for delta in stream:
+                if cancelled.is_set():
+                    raise LLMCancelled()
+                parts.append(delta)
+        finally:
+            stream.close()
+        return "".join(parts)
+
+    provider = get_provider()
+    model = provider.model(role)
+    started = time.perf_counter()
+    key = None
+    if use_cache:
+        cache = get_llm_cache()
+        key = cache.make_key(model, messages, temperature, max_tokens, provider=provider.name, **extra)
+        cached = cache.get(key)
+        if cached is not None:
+            record_llm_call(function, provider.name, model, "cached", time.perf_counter() - started)
+            return cached
+
+    retries = []
+    try:
+        completion = get_scheduler(provider.classify_error).run(
+            model,
+            estimate_tokens(messages, max_tokens),
+            lambda: provider.complete(model, messages, temperature, max_tokens, **extra),
+            on_retry=retries.append
+        )
+    except LLMError as e:
+        record_llm_call(function, provider.name, model, "error", time.perf_counter() - started,
+                        retries=len(retries), error_kind=e.kind)
+        raise
+    content = completion.text
+    record_llm_call(
+        function, provider.name, model, "ok", time.perf_counter() - started,
+        prompt_tokens=completion.prompt_tokens if completion.prompt_tokens is not None else estimate_tokens(messages, 0),
+        completion_tokens=completion.completion_tokens if completion.completion_tokens is not None else len(content or "") // 4,
+        retries=len(retries)
+    )
+    if key is not None and content:
+        get_llm_cache().set(key, content)
+    return content
+
+def _prd_section_messages(section_title: str, mrd_text: str, product_name: str,
+                          outline: str = "", additional_context: str = "") -> List[Dict]:
+    """Build the chat messages for generating a single PRD section"""
     prompt = (
         f"You are a product manager generating a PRD. Based on the following MRD and product name '{product_name}', "
         f"write a concise and clear PRD section titled '{section_title}'. Avoid repetition and explain only the key ideas.\n\n"
         f"MRD Content:\n{mrd_text}"
     )
+    if additional_context:
+        prompt += f"\n\nAdditional Context:\n{additional_context}"
+    if outline:
+        # Sections are written in parallel - the shared outline keeps them consistent
+        prompt += (
+            f"\n\nOutline of the whole PRD (other sections are written separately, stay consistent with it):\n{outline}"
+            f"\n\nReturn only the body of the '{section_title}' section in markdown, without the section heading."
+        )
+    return [
+        {"role": "system", "content": "You are a professional product document writer."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_prd_section(section_title: str, mrd_text: str, product_name: str,
+                         outline: str = "", additional_context: str = "", use_cache: bool = False,
+                         cancelled: Optional[threading.Event] = None) -> str:
+    """Generate a specific section of PRD based on MRD content. Raises LLMError, or LLMCancelled once cancelled is set."""
+    return _chat_completion(
+        "generate_prd_section",
+        "main",
+        _prd_section_messages(section_title, mrd_text, product_name, outline, additional_context),
+        temperature=0.7,
+        max_tokens=2000,
+        use_cache=use_cache,
+        cancelled=cancelled
+    ).strip()
+
+def generate_prd_outline(mrd_content: str, product_name: str, additional_context: str = "",
+                         use_cache: bool = False, cancelled: Optional[threading.Event] = None) -> str:
+    """Generate a short shared outline (key points per section) for parallel section generation"""
+    sections = "\n".join(f"{i}. {title}" for i, title in enumerate(PRD_SECTIONS, 1))
+    prompt = f"""
+Draft a brief outline for a Product Requirements Document (PRD) for '{product_name}' based on the following Market Requirements Document (MRD) content.
 
+MRD Content:
+{mrd_content}
+
+Additional Context:
+{additional_context}
+
+For each of these sections list 2-4 terse bullet points with the key decisions, names and numbers it must cover:
+{sections}
+
+Return only the outline.
+"""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Using GPT-4o as GPT-5 is not yet available
-            messages=[
-                {"role": "system", "content": "You are a professional product document writer."},
+        return _chat_completion(
+            "generate_prd_outline",
+            "fast",
+            [
+                {"role": "system", "content": "You are a professional product manager planning PRD documents."},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
-            max_tokens=2000
+            temperature=0.3,
+            max_tokens=800,
+            use_cache=use_cache,
+            cancelled=cancelled
+        ).strip()
+    except LLMCancelled:
+        raise
+    except Exception as e:
+        print(f"Outline generation failed, sections will be generated without it: {e}")
+        return ""
+
+def _strip_leading_heading(text: str, section_title: str) -> str:
+    """Drop a heading the model repeated at the top of a section body"""
+    first_line, _, rest = text.partition("\n")
+    if first_line.lstrip().startswith("#") and section_title.lower() in first_line.lower():
+        return rest.strip()
+    return text
+
+def _run_concurrently(calls: List[Callable[[], str]], max_workers: int,
+                      on_done: Optional[Callable[[int, int], None]] = None) -> List[str]:
+    """Run the calls on a bounded pool and return their results in order.
+
+    on_done(done, total) is called in the caller's thread after each call; if it
+    or a call raises, calls not yet started are dropped and the error propagates.
+    """
+    results = [None] * len(calls)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(contextvars.copy_context().run, call): i for i, call in enumerate(calls)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if on_done:
+                on_done(done, len(calls))
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return results
+
+def _summarize_mrd_part(part: str, number: int, total: int, product_name: str) -> str:
+    prompt = f"""
+Below is part {number} of {total} of the source material (an MRD, meeting transcript or similar) for '{product_name}'. Consecutive parts overlap slightly.
+
+Summarize this part as terse bullet points. Keep every requirement, user group, feature, decision, metric, date, number, name, constraint and open question; drop small talk and repetition. Do not add anything that is not in the text.
+
+Part {number}/{total}:
+{part}
+"""
+    return _chat_completion(
+        "summarize_mrd_part",
+        "fast",
+        [
+            {"role": "system", "content": "You are a product manager condensing source material for a PRD."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.2,
+        max_tokens=int(os.environ.get("MRD_MAP_SUMMARY_TOKENS", 800)),
+        use_cache=True
+    ).strip()
+
+def _merge_mrd_summaries(summaries: List[str], product_name: str, max_tokens: int) -> str:
+    joined = "\n\n".join(f"Summary {i}:\n{summary}" for i, summary in enumerate(summaries, 1))
+    prompt = f"""
+Merge these summaries of consecutive parts of the source material for '{product_name}' into one condensed brief for writing its PRD.
+
+Remove duplicates (the parts overlapped) but keep every specific requirement, decision, metric, date, number and name. Organize the brief under the headings Goals, Users, Requirements, Constraints, Metrics, Timeline and Open Questions, leaving out empty ones.
+
+{joined}
+"""
+    return _chat_completion(
+        "merge_mrd_summaries",
+        "main",
+        [
+            {"role": "system", "content": "You are a product manager condensing source material for a PRD."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.2,
+        max_tokens=max_tokens,
+        use_cache=True
+    ).strip()
+
+def condense_mrd(mrd_content: str, product_name: str, budget_tokens: Optional[int] = None, max_workers: int = 4,
+                 on_progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """Token-counting pre-pass for PRD generation: fit the MRD into budget_tokens (default MRD_PROMPT_TOKENS).
+
+    Input within the budget is returned unchanged. Larger input is split into
+    overlapping parts that are summarized concurrently (map), then the summaries
+    are merged - in rounds if they do not fit one request - into a condensed
+    brief (reduce). Part summaries and merges always go through the LLM response
+    cache, independent of the session's cache setting, so regenerating from the
+    same MRD repeats neither phase. on_progress(done, total) follows the map
+    phase and may raise to abort it. Raises LLMError.
+    """
+    budget = budget_tokens or int(os.environ.get("MRD_PROMPT_TOKENS", 12000))
+    if not mrd_content or count_tokens(mrd_content) <= budget:
+        return mrd_content
+
+    part_tokens = int(os.environ.get("MRD_MAP_CHUNK_TOKENS", 6000))
+    parts = split_overlapping(mrd_content, part_tokens, int(os.environ.get("MRD_MAP_OVERLAP_TOKENS", 300)))
+    print(f"MRD exceeds {budget} tokens - condensing {len(parts)} parts")
+    summaries = _run_concurrently(
+        [lambda i=i, part=part: _summarize_mrd_part(part, i, len(parts), product_name) for i, part in enumerate(parts, 1)],
+        max_workers,
+        on_progress
+    )
+
+    brief_tokens = min(budget, int(os.environ.get("MRD_BRIEF_TOKENS", 4000)))
+    while True:
+        # Consecutive summaries that fit one merge request, at least two per group so every round shrinks
+        groups, group, used = [], [], 0
+        for summary in summaries:
+            tokens = count_tokens(summary)
+            if group and used + tokens > part_tokens and len(group) >= 2:
+                groups.append(group)
+                group, used = [], 0
+            group.append(summary)
+            used += tokens
+        groups.append(group)
+
+        if len(groups) == 1:
+            return _merge_mrd_summaries(groups[0], product_name, brief_tokens)
+        summaries = _run_concurrently(
+            [lambda group=group: _merge_mrd_summaries(group, product_name, brief_tokens) for group in groups],
+            max_workers
         )
-        return response.choices[0].message.content.strip()
 
-    except RateLimitError:
-        return "Rate limit exceeded. Please try again later."
-    except Exception as e:
-        return f"Error: {str(e)}"
+def generate_initial_prd_parallel(mrd_content: str, product_name: str, additional_context: str = "",
+                                  max_workers: int = 4,
+                                  on_progress: Optional[Callable[[str], None]] = None,
+                                  use_cache: bool = False, section_mrd: Optional[Dict[str, str]] = None,
+                                  cancelled: Optional[threading.Event] = None) -> Tuple[str, List[str]]:
+    """Generate the initial PRD section by section in parallel.
+
+    The MRD is expected to fit the prompt already (see jobs.prepare_mrd_prompt). A
+    shared outline is generated first, then the sections run concurrently on a
+    bounded thread pool and are assembled in document order. Transient failures are
+    retried by the scheduler; a section that still fails is left out of the result,
+    and LLMError is raised only if every section failed. Returns (document, titles
+    of the sections left out). on_progress, called in the caller's thread,
+    receives the partially assembled document as sections land - there a failed
+    section shows a placeholder, which never reaches the returned document;
+    if it raises (e.g. the job was cancelled), sections not yet started are dropped.
+    section_mrd optionally maps a section title to the MRD excerpt written into
+    that section's prompt instead of the whole mrd_content. Setting cancelled
+    aborts the outline and all in-flight section requests and raises LLMCancelled.
+    """
+    outline = generate_prd_outline(mrd_content, product_name, additional_context, use_cache=use_cache,
+                                   cancelled=cancelled)
+
+    def write_section(section_title: str) -> str:
+        section_text = section_mrd.get(section_title, mrd_content) if section_mrd else mrd_content
+        text = generate_prd_section(section_title, section_text, product_name, outline, additional_context,
+                                    use_cache=use_cache, cancelled=cancelled)
+        return _strip_leading_heading(text, section_title)
+
+    def assemble(sections: Dict[str, str], placeholders: Optional[Dict[str, str]] = None) -> str:
+        parts = [f"# {product_name} - Product Requirements Document"]
+        for i, title in enumerate(PRD_SECTIONS, 1):
+            text = sections.get(title) or (placeholders or {}).get(title)
+            if text:
+                parts.append(f"## {i}. {title}\n\n{text}")
+        return "\n\n".join(parts)
+
+    sections = {}
+    failures = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # Each section runs in a copy of the caller's context, so telemetry keeps its session
+        futures = {
+            executor.submit(contextvars.copy_context().run, write_section, title): title
+            for title in PRD_SECTIONS
+        }
+        for future in as_completed(futures):
+            title = futures[future]
+            try:
+                sections[title] = future.result()
+            except LLMError as e:
+                failures[title] = e
+            if on_progress:
+                # Only the live preview shows the failed sections - the saved document leaves them out
+                on_progress(assemble(sections, {
+                    failed: f"_This section could not be generated ({error.kind}). Ask the assistant to write it._"
+                    for failed, error in failures.items()
+                }))
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
 
-def generate_interactive_prd_update(current_prd: str, user_request: str, product_name: str, context: str = "") -> str:
-    """Generate an updated PRD based on user request in interactive chat mode"""
+    if len(failures) == len(PRD_SECTIONS):
+        raise next(iter(failures.values()))
+    return assemble(sections), [title for title in PRD_SECTIONS if title in failures]
+
+def _prd_update_messages(current_prd: str, user_request: str, product_name: str, context: str = "") -> List[Dict]:
+    """Build the chat messages for an interactive PRD update"""
     prompt = f"""
 You are an expert product manager helping to iteratively improve a PRD document.
 
@@ -55,25 +354,14 @@ Keep the existing structure but modify/add/remove content as requested.
 Be precise and professional in your modifications.
 Return only the updated PRD content, no additional commentary.
 """
+    return [
+        {"role": "system", "content": "You are a professional product document writer specializing in PRD creation and iterative improvements."},
+        {"role": "user", "content": prompt}
+    ]
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a professional product document writer specializing in PRD creation and iterative improvements."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=3000
-        )
-        return response.choices[0].message.content.strip()
-    except RateLimitError:
-        return "Rate limit exceeded. Please try again later."
-    except Exception as e:
-        return f"Error: {str(e)}"
-
-def generate_initial_prd(mrd_content: str, product_name: str, additional_context: str = "") -> str:
-    """Generate initial comprehensive PRD from MRD content"""
+def _initial_prd_messages(mrd_content: str, product_name: str, additional_context: str = "") -> List[Dict]:
+    """Build the chat messages for generating the initial PRD"""
+    sections = "\n".join(f"{i}. {title}" for i, title in enumerate(PRD_SECTIONS, 1))
     prompt = f"""
 Create a comprehensive Product Requirements Document (PRD) for '{product_name}' based on the following Market Requirements Document (MRD) content.
 
@@ -84,35 +372,217 @@ Additional Context:
 {additional_context}
 
 Please structure the PRD with the following sections:
-1. Executive Summary
-2. Product Overview
-3. User Stories & Requirements
-4. Technical Requirements
-5. Success Metrics
-6. Timeline & Milestones
-7. Risk Assessment
+{sections}
 
 Make it comprehensive, clear, and actionable. Use proper markdown formatting.
 """
+    return [
+        {"role": "system", "content": "You are a professional product manager creating detailed PRD documents."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _stream_completion(function: str, role: str, messages: List[Dict], temperature: float, max_tokens: int,
+                       use_cache: bool = False, cancelled: Optional[threading.Event] = None, **extra) -> Iterator[str]:
+    """Yield content deltas of a streamed chat completion for role ("main" or "fast") as they arrive.
+
+    Opening the stream goes through the scheduler, which holds a concurrency slot
+    until the stream is closed. Failures are raised as LLMError. With use_cache a
+    cached response is yielded as a single chunk; a streamed one is cached only if
+    it was consumed to the end. The call is recorded in the LLM telemetry under
+    function, as "cancelled" if the consumer stopped early. Setting cancelled
+    aborts the scheduler's waits and the open request and raises LLMCancelled.
+    """
+    provider = get_provider()
+    model = provider.model(role)
+    started = time.perf_counter()
+    key = None
+    if use_cache:
+        cache = get_llm_cache()
+        key = cache.make_key(model, messages, temperature, max_tokens, provider=provider.name, **extra)
+        cached = cache.get(key)
+        if cached is not None:
+            record_llm_call(function, provider.name, model, "cached", time.perf_counter() - started, streamed=True)
+            yield cached
+            return
 
+    retries = []
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a professional product manager creating detailed PRD documents."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=4000
+        stream, release = get_scheduler(provider.classify_error).stream(
+            model,
+            estimate_tokens(messages, max_tokens),
+            lambda: provider.open_stream(model, messages, temperature, max_tokens, **extra),
+            on_retry=retries.append,
+            cancelled=cancelled
         )
-        return response.choices[0].message.content.strip()
-    except RateLimitError:
-        return "Rate limit exceeded. Please try again later."
+    except LLMError as e:
+        record_llm_call(function, provider.name, model, "error", time.perf_counter() - started,
+                        retries=len(retries), streamed=True, error_kind=e.kind)
+        raise
+    finished = threading.Event()
+    if cancelled is not None:
+        def close_on_cancel():
+            # The first token can take many seconds - closing the stream from here ends that wait too
+            while not finished.wait(0.2):
+                if cancelled.is_set():
+                    stream.close()
+                    return
+        threading.Thread(target=close_on_cancel, name="llm-stream-cancel", daemon=True).start()
+
+    parts = []
+    first_token_at = None
+    status, error_kind = "cancelled", None
+    try:
+        for delta in stream:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(delta)
+            yield delta
+        if cancelled is not None and cancelled.is_set():
+            # Closed by close_on_cancel - the text is incomplete
+            raise LLMCancelled()
+        status = "ok"
+        if key is not None and parts:
+            get_llm_cache().set(key, "".join(parts))
+    except LLMCancelled:
+        raise
+    except LLMError as e:
+        if cancelled is not None and cancelled.is_set():
+            raise LLMCancelled() from e
+        status, error_kind = "error", e.kind
+        raise
     except Exception as e:
-        return f"Error: {str(e)}"
+        if cancelled is not None and cancelled.is_set():
+            raise LLMCancelled() from e
+        error = provider.classify_error(e)
+        status, error_kind = "error", error.kind
+        raise error from e
+    finally:
+        # Release the HTTP connection and the scheduler slot even if the consumer stops early
+        finished.set()
+        stream.close()
+        release()
+        # An aborted stream reports no usage - estimate what was generated until then
+        record_llm_call(
+            function, provider.name, model, status, time.perf_counter() - started,
+            time_to_first_token=first_token_at - started if first_token_at is not None else None,
+            prompt_tokens=stream.prompt_tokens if stream.prompt_tokens is not None else estimate_tokens(messages, 0),
+            completion_tokens=stream.completion_tokens if stream.completion_tokens is not None else len("".join(parts)) // 4,
+            retries=len(retries),
+            streamed=True,
+            error_kind=error_kind
+        )
+
+def generate_interactive_prd_update(current_prd: str, user_request: str, product_name: str, context: str = "",
+                                    use_cache: bool = False) -> str:
+    """Generate an updated PRD based on user request in interactive chat mode. Raises LLMError."""
+    return _chat_completion(
+        "generate_interactive_prd_update",
+        "fast",
+        _prd_update_messages(current_prd, user_request, product_name, context),
+        temperature=0.7,
+        max_tokens=3000,
+        use_cache=use_cache
+    ).strip()
+
+def stream_interactive_prd_update(current_prd: str, user_request: str, product_name: str, context: str = "",
+                                  use_cache: bool = False, cancelled: Optional[threading.Event] = None) -> Iterator[str]:
+    """Streaming variant of generate_interactive_prd_update - yields text deltas.
+
+    LLMError is raised to the caller, since part of the PRD may already have been yielded;
+    LLMCancelled once cancelled is set.
+    """
+    return _stream_completion(
+        "stream_interactive_prd_update",
+        "fast",
+        _prd_update_messages(current_prd, user_request, product_name, context),
+        temperature=0.7,
+        max_tokens=3000,
+        use_cache=use_cache,
+        cancelled=cancelled
+    )
 
-def generate_change_summary(old_content: str, new_content: str) -> str:
+def generate_prd_edits(current_prd: str, user_request: str, product_name: str, context: str = "",
+                       use_cache: bool = False, cancelled: Optional[threading.Event] = None) -> Optional[List[Dict]]:
+    """Ask for a user's change as structured section edits instead of a full rewrite.
+
+    Returns the list of edits for markdown_utils.apply_prd_edits, or None when the model
+    decides the request needs a full regeneration. Raises LLMError, or ValueError on malformed output;
+    LLMCancelled once cancelled is set.
+    """
+    prompt = f"""
+You are an expert product manager making a targeted change to a PRD document.
+
+Current PRD for '{product_name}':
+{current_prd}
+
+Additional context:
+{context}
+
+User's request for changes:
+{user_request}
+
+Do not rewrite the document. Return a JSON object {{"edits": [...]}} with the smallest set of section edits that fulfils the request.
+Each edit addresses a section by its heading path (heading titles from the outermost to the target, e.g. ["Technical Requirements", "APIs"]):
+- {{"op": "replace", "path": [...], "content": "<new markdown body of the section, without its heading>"}}
+- {{"op": "insert", "path": [...], "content": "<new section(s) in markdown, with their headings>"}} - inserted after the given section; use "path": [] to append at the end
+- {{"op": "delete", "path": [...]}}
+If the request changes most of the document (e.g. restructure, rewrite, change tone everywhere), return {{"full_rewrite": true}} instead.
+"""
+    content = _chat_completion(
+        "generate_prd_edits",
+        "fast",
+        [
+            {"role": "system", "content": "You are a professional product document writer. You answer with JSON only."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=1500,
+        use_cache=use_cache,
+        cancelled=cancelled,
+        response_format={"type": "json_object"}
+    )
+    result = json.loads(content)
+    if result.get("full_rewrite"):
+        return None
+    edits = result.get("edits")
+    if not isinstance(edits, list) or not edits:
+        raise ValueError("Model returned no edits")
+    return edits
+
+def generate_initial_prd(mrd_content: str, product_name: str, additional_context: str = "",
+                         use_cache: bool = False) -> str:
+    """Generate initial comprehensive PRD from MRD content fitted to the prompt (jobs.prepare_mrd_prompt). Raises LLMError."""
+    return _chat_completion(
+        "generate_initial_prd",
+        "main",
+        _initial_prd_messages(mrd_content, product_name, additional_context),
+        temperature=0.7,
+        max_tokens=4000,
+        use_cache=use_cache
+    ).strip()
+
+def stream_initial_prd(mrd_content: str, product_name: str, additional_context: str = "",
+                       use_cache: bool = False, cancelled: Optional[threading.Event] = None) -> Iterator[str]:
+    """Streaming variant of generate_initial_prd - yields text deltas.
+
+    LLMError is raised to the caller, since part of the PRD may already have been yielded;
+    LLMCancelled once cancelled is set.
+    """
+    return _stream_completion(
+        "stream_initial_prd",
+        "main",
+        _initial_prd_messages(mrd_content, product_name, additional_context),
+        temperature=0.7,
+        max_tokens=4000,
+        use_cache=use_cache,
+        cancelled=cancelled
+    )
+
+def generate_change_summary(old_content: str, new_content: str, local_summary: str = "",
+                            use_cache: bool = False) -> str:
     """Generate a summary of changes between two PRD versions"""
+    # The section-level summary from diff_utils covers changes beyond the excerpts below
+    hint = f"\nSection-level diff statistics:\n{local_summary}\n" if local_summary else ""
     prompt = f"""
 Compare these two versions of a PRD and provide a brief summary of the key changes made:
 
@@ -121,20 +591,48 @@ Previous version:
 
 New version:
 {new_content[:1000]}...
-
+{hint}
 Provide a concise summary of what was changed, added, or removed.
 """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        return _chat_completion(
+            "generate_change_summary",
+            "main",
+            [
                 {"role": "system", "content": "You are an expert at analyzing document changes."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,
-            max_tokens=200
-        )
-        return response.choices[0].message.content.strip()
+            max_tokens=200,
+            use_cache=use_cache
+        ).strip()
     except Exception as e:
         return "Unable to generate change summary"
+
+def summarize_conversation(previous_summary: str, messages: List[Dict], product_name: str, max_tokens: int = 400,
+                           use_cache: bool = False) -> str:
+    """Fold chat messages into the rolling summary of a PRD conversation. Raises LLMError."""
+    turns = "\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in messages)
+    prompt = f"""
+You maintain the running summary of a conversation in which a user iteratively edits the PRD for '{product_name}'.
+
+Current summary:
+{previous_summary or "(none yet)"}
+
+New messages:
+{turns}
+
+Return the updated summary in at most {max_tokens * 3 // 4} words. Keep the user's standing instructions and preferences (tone, length, scope, things to keep or avoid), decisions made and requests still open; drop pleasantries and details of the PRD text itself.
+"""
+    return _chat_completion(
+        "summarize_conversation",
+        "fast",
+        [
+            {"role": "system", "content": "You summarize product conversations concisely."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.2,
+        max_tokens=max_tokens,
+        use_cache=use_cache
+    ).strip()
@@ -0,0 +1,135 @@
+import re
+from typing import List, Dict, Optional
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+FENCE_RE = re.compile(r'^\s*(```|~~~)')
+
+def normalize_heading(title: str) -> str:
+    """Normalize a heading for matching: no markdown emphasis, numbering or case"""
+    title = re.sub(r'[*_`]', '', title)
+    title = re.sub(r'^\s*\d+(\.\d+)*\.?\s+', '', title)
+    return ' '.join(title.lower().split())
+
+def parse_sections(markdown: str) -> List[Dict]:
+    """Split markdown into heading sections.
+
+    Each section is a dict with title, level, path (titles of the enclosing headings
+    down to this one) and the line range [start, end) it covers, including its
+    subsections. Headings inside fenced code blocks are ignored.
+    """
+    lines = markdown.splitlines(keepends=True)
+    sections = []
+    stack = []
+    in_fence = False
+
+    for index, line in enumerate(lines):
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else HEADING_RE.match(line)
+        if not match:
+            continue
+
+        level = len(match.group(1))
+        # Close every open section at the same or a deeper level
+        while stack and stack[-1]['level'] >= level:
+            stack.pop()['end'] = index
+
+        section = {
+            'title': match.group(2),
+            'level': level,
+            'path': [s['title'] for s in stack] + [match.group(2)],
+            'start': index,
+            'end': len(lines)
+        }
+        sections.append(section)
+        stack.append(section)
+
+    return sections
+
+def section_for_line(sections: List[Dict], line_number: int) -> Optional[Dict]:
+    """Return the innermost section containing a line, or None for text before the first heading"""
+    found = None
+    for section in sections:
+        if section['start'] <= line_number < section['end']:
+            found = section
+    return found
+
+def find_section(markdown: str, path: List[str]) -> Dict:
+    """Find the single section whose heading path ends with the given path"""
+    wanted = [normalize_heading(title) for title in path]
+    matches = [
+        section for section in parse_sections(markdown)
+        if [normalize_heading(title) for title in section['path'][-len(wanted):]] == wanted
+    ]
+    if not matches:
+        raise ValueError(f"Section not found: {' > '.join(path)}")
+    if len(matches) > 1:
+        raise ValueError(f"Section path is ambiguous: {' > '.join(path)}")
+    return matches[0]
+
+def _as_block(text: str) -> List[str]:
+    """Turn edit content into whole lines ending with a newline"""
+    text = text.strip('\n')
+    return [line + '\n' for line in text.split('\n')] if text else []
+
+def _join_blocks(*blocks: List[str]) -> List[str]:
+    """Concatenate line blocks with exactly one blank line at each seam, leaving their insides untouched"""
+    result = []
+    for block in blocks:
+        block = list(block)
+        if not block:
+            continue
+        if result:
+            while result and not result[-1].strip():
+                result.pop()
+            while block and not block[0].strip():
+                block.pop(0)
+            result.append('\n')
+        result.extend(block)
+    return result
+
+def apply_prd_edits(markdown: str, edits: List[Dict]) -> str:
+    """Apply structured section edits to a markdown PRD.
+
+    Supported edits, applied in order:
+      {"op": "replace", "path": [...], "content": "..."}  new body for the section and its subsections (heading is kept)
+      {"op": "insert", "path": [...], "content": "..."}   new section(s) after the section; empty path appends
+      {"op": "delete", "path": [...]}                     remove the section with its subsections
+
+    Raises ValueError if an edit is malformed or its path does not match exactly one section.
+    """
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise ValueError(f"Malformed edit: {edit!r}")
+        op = edit.get('op')
+        path = edit.get('path') or []
+        if isinstance(path, str):
+            path = [path]
+        content = edit.get('content', '')
+        if op not in ('replace', 'insert', 'delete'):
+            raise ValueError(f"Unknown edit operation: {op}")
+        if not isinstance(content, str):
+            raise ValueError("Edit content must be a string")
+
+        lines = markdown.splitlines(keepends=True)
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+
+        if op == 'insert' and not path:
+            lines = _join_blocks(lines, _as_block(content))
+        else:
+            if not path:
+                raise ValueError(f"'{op}' edit needs a section path")
+            section = find_section(markdown, path)
+            start, end = section['start'], section['end']
+            if op == 'replace':
+                lines = _join_blocks(lines[:start + 1], _as_block(content), lines[end:])
+            elif op == 'insert':
+                lines = _join_blocks(lines[:end], _as_block(content), lines[end:])
+            else:
+                lines = _join_blocks(lines[:start], lines[end:])
+
+        markdown = ''.join(lines)
+
+    return markdown.strip()
@@ -0,0 +1,255 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .markdown_utils import HEADING_RE
+
+# Headings in text extracted from PDF/DOCX files: "2.1 Target Users", "3. PRICING"
+NUMBERED_HEADING_RE = re.compile(r'^\s*(\d+(?:\.\d+)*)\.?\s+([A-Z][^\n]{0,80})$')
+WORD_RE = re.compile(r'\w+')
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can for from has have in is it its of on or our should that the their this "
+    "to was we will with".split()
+)
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """Tokens in text: exact with tiktoken if it is installed, otherwise ~4 characters per token"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Not installed, or the encoding could not be loaded (offline)
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def _heading(line: str) -> Optional[tuple]:
+    """(level, title) if the line looks like a heading"""
+    stripped = line.strip()
+    if not stripped or len(stripped) > 90:
+        return None
+    match = HEADING_RE.match(stripped)
+    if match:
+        return len(match.group(1)), match.group(2)
+    match = NUMBERED_HEADING_RE.match(stripped)
+    if match and not stripped.endswith(('.', ',', ';', ':')) and len(match.group(2).split()) <= 10:
+        return match.group(1).count('.') + 1, stripped
+    words = stripped.split()
+    if stripped.isupper() and 1 <= len(words) <= 8 and any(c.isalpha() for c in stripped):
+        return 1, stripped
+    return None
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Split a paragraph that alone exceeds max_tokens at sentence boundaries"""
+    pieces, current = [], ""
+    for sentence in SENTENCE_END_RE.split(text):
+        candidate = f"{current} {sentence}".strip()
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    # A single huge "sentence" (tables, lists without punctuation) is cut by characters
+    result = []
+    for piece in pieces:
+        while count_tokens(piece) > max_tokens and len(piece) > max_tokens * 4:
+            result.append(piece[:max_tokens * 4])
+            piece = piece[max_tokens * 4:]
+        result.append(piece)
+    return result
+
+def chunk_mrd(text: str, max_tokens: int = 400) -> List[Dict]:
+    """Split MRD text into chunks of at most max_tokens that never cross a heading.
+
+    Paragraphs are kept together where possible. Each chunk is a dict with
+    heading (the heading path, e.g. "2 Market > 2.1 Target Users"), content
+    and tokens, in document order.
+    """
+    chunks = []
+    stack: List[tuple] = []
+    paragraphs: List[str] = []
+
+    def heading_path() -> str:
+        return " > ".join(title for _, title in stack)
+
+    def flush():
+        current, current_tokens = [], 0
+        for paragraph in paragraphs:
+            for piece in (_split_long(paragraph, max_tokens) if count_tokens(paragraph) > max_tokens else [paragraph]):
+                tokens = count_tokens(piece)
+                if current and current_tokens + tokens > max_tokens:
+                    chunks.append({'heading': heading_path(), 'content': "\n\n".join(current), 'tokens': current_tokens})
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        if current:
+            chunks.append({'heading': heading_path(), 'content': "\n\n".join(current), 'tokens': current_tokens})
+        paragraphs.clear()
+
+    lines: List[str] = []
+    for line in text.splitlines():
+        heading = _heading(line)
+        if heading:
+            if lines:
+                paragraphs.append(" ".join(lines))
+                lines = []
+            flush()
+            level, title = heading
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, title))
+        elif line.strip():
+            lines.append(line.strip())
+        elif lines:
+            paragraphs.append(" ".join(lines))
+            lines = []
+    if lines:
+        paragraphs.append(" ".join(lines))
+    flush()
+    return chunks
+
+def split_overlapping(text: str, chunk_tokens: int, overlap_tokens: int) -> List[str]:
+    """Split text at line boundaries into parts of at most chunk_tokens.
+
+    Each part starts with the last ~overlap_tokens of the previous one, so a
+    statement cut at a boundary is still seen whole by one of the parts.
+    Works for text without headings or blank lines, e.g. meeting transcripts.
+    """
+    units = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        units.extend(_split_long(line.strip(), chunk_tokens) if count_tokens(line) > chunk_tokens else [line.strip()])
+    tokens = [count_tokens(unit) for unit in units]
+
+    parts = []
+    start = 0
+    while start < len(units):
+        end, used = start, 0
+        while end < len(units) and (end == start or used + tokens[end] <= chunk_tokens):
+            used += tokens[end]
+            end += 1
+        parts.append("\n".join(units[start:end]))
+        if end >= len(units):
+            break
+        # Step back into this part, always moving forward by at least one line
+        back, overlap = end, 0
+        while back > start + 1 and overlap + tokens[back - 1] <= overlap_tokens:
+            back -= 1
+            overlap += tokens[back]
+        start = back
+    return parts
+
+def _terms(text: str) -> List[str]:
+    return [word for word in WORD_RE.findall(text.lower()) if word not in STOPWORDS and len(word) > 1]
+
+class MRDIndex:
+    """BM25 index over the chunks of one MRD.
+
+    Building it is a single pass over the chunks, so it is rebuilt from the
+    stored chunks whenever it is needed instead of being persisted itself.
+    """
+
+    def __init__(self, chunks: List[Dict], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self._costs = None
+        self.k1 = k1
+        self.b = b
+        # The heading takes part in matching - "Pricing" should find the pricing section
+        self._term_counts = [Counter(_terms(f"{chunk['heading']} {chunk['content']}")) for chunk in chunks]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if chunks else 0.0
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        total = len(chunks)
+        self._idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    @classmethod
+    def from_text(cls, text: str, max_chunk_tokens: int = 400) -> "MRDIndex":
+        return cls(chunk_mrd(text, max_chunk_tokens))
+
+    @property
+    def total_tokens(self) -> int:
+        """Tokens of the whole MRD as _format renders it"""
+        return sum(self._formatted_tokens())
+
+    def _formatted_tokens(self) -> List[int]:
+        """Tokens each chunk takes up in _format's output - heading line, content and separator"""
+        if self._costs is None:
+            separator = count_tokens("\n\n")
+            self._costs = [
+                chunk['tokens'] + separator + (count_tokens(f"[{chunk['heading']}]\n") if chunk['heading'] else 0)
+                for chunk in self.chunks
+            ]
+        return self._costs
+
+    def search(self, query: str, k: int = 8) -> List[int]:
+        """Indexes of the k chunks most relevant to query, best first"""
+        query_terms = set(_terms(query))
+        scores = []
+        for index, counts in enumerate(self._term_counts):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / (self._avg_length or 1))
+            for term in query_terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((score, index))
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return [index for _, index in scores[:k]]
+
+    def _format(self, indexes: List[int]) -> str:
+        """The chosen chunks in document order, each under its heading"""
+        parts = []
+        for index in sorted(indexes):
+            chunk = self.chunks[index]
+            parts.append(f"[{chunk['heading']}]\n{chunk['content']}" if chunk['heading'] else chunk['content'])
+        return "\n\n".join(parts)
+
+    def _fill(self, ranked: List[int], budget_tokens: int) -> List[int]:
+        """Chunks in ranked order while their formatted text fits budget_tokens"""
+        costs = self._formatted_tokens()
+        chosen, used = set(), 0
+        for index in ranked:
+            if index in chosen:
+                continue
+            tokens = costs[index]
+            if used + tokens <= budget_tokens:
+                chosen.add(index)
+                used += tokens
+        return list(chosen)
+
+    def context(self, query: str, budget_tokens: int, k: int = 8) -> str:
+        """Excerpts most relevant to query, at most k chunks and budget_tokens tokens"""
+        return self._format(self._fill(self.search(query, k), budget_tokens))
+
+    def overview(self, queries: List[str], budget_tokens: int) -> str:
+        """The whole MRD if it fits the budget, otherwise the chunks that best cover all queries.
+
+        Queries take turns picking their next best chunk, so every topic (e.g. every
+        PRD section) gets a share of the budget; the opening chunk is always kept and
+        budget left over goes to unmatched chunks in document order.
+        """
+        if self.total_tokens <= budget_tokens:
+            return self._format(list(range(len(self.chunks))))
+        rankings = [self.search(query, k=len(self.chunks)) for query in queries]
+        ranked = [0] if self.chunks else []
+        for position in range(max((len(ranking) for ranking in rankings), default=0)):
+            ranked.extend(ranking[position] for ranking in rankings if position < len(ranking))
+        ranked.extend(range(len(self.chunks)))
+        return self._format(self._fill(ranked, budget_tokens))
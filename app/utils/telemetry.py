@@ -0,0 +1,145 @@
+import atexit
+import contextvars
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Session the current LLM calls belong to; set by the code that starts work for a session
+_session_id = contextvars.ContextVar("llm_session_id", default=None)
+
+@contextmanager
+def llm_session(session_id: Optional[str]):
+    """Attribute the LLM calls made inside the block (in this thread or context) to a session"""
+    token = _session_id.set(session_id)
+    try:
+        yield
+    finally:
+        _session_id.reset(token)
+
+class TelemetryWriter:
+    """Buffers LLM call records and writes them to the llm_calls table in batches.
+
+    record() only appends to an in-memory queue, so the request path never waits
+    for the database; a background thread flushes every flush_interval seconds.
+    When the buffer is full, records are dropped (and counted) rather than
+    blocking a generation.
+    """
+
+    def __init__(self, db, flush_interval: float = 2.0, batch_size: int = 500, max_buffer: int = 10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="llm-telemetry", daemon=True)
+        self._thread.start()
+
+    def record(self, call: Dict):
+        try:
+            self._queue.put_nowait(call)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._flush_lock:
+            while True:
+                rows = []
+                while len(rows) < self.batch_size:
+                    try:
+                        rows.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not rows:
+                    return
+                try:
+                    self.db.insert_llm_calls(rows)
+                except Exception as e:
+                    print(f"⚠️ Could not write {len(rows)} LLM call records: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+_writer: Optional[TelemetryWriter] = None
+_writer_lock = threading.Lock()
+
+def start_telemetry(db) -> Optional[TelemetryWriter]:
+    """Start recording LLM calls into db's llm_calls table, unless LLM_TELEMETRY_ENABLED=false.
+
+    Without a started writer record_llm_call() does nothing, e.g. in benchmarks.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None and os.environ.get("LLM_TELEMETRY_ENABLED", "true").lower() == "true":
+            _writer = TelemetryWriter(db, flush_interval=float(os.environ.get("LLM_TELEMETRY_FLUSH_SECONDS", 2)))
+            atexit.register(_writer.close)
+        return _writer
+
+def record_llm_call(function: str, provider: str, model: str, status: str, latency: float,
+                    time_to_first_token: Optional[float] = None, prompt_tokens: Optional[int] = None,
+                    completion_tokens: Optional[int] = None, retries: int = 0, streamed: bool = False,
+                    error_kind: Optional[str] = None):
+    """Queue one LLM call record; status is "ok", "cached", "cancelled" or "error" (with error_kind)"""
+    if _writer is None:
+        return
+    _writer.record({
+        'created_at': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        'session_id': _session_id.get(),
+        'function': function,
+        'provider': provider,
+        'model': model,
+        'status': status,
+        'error_kind': error_kind,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'latency_ms': round(latency * 1000, 1),
+        'ttft_ms': round(time_to_first_token * 1000, 1) if time_to_first_token is not None else None,
+        'retries': retries,
+        'streamed': int(streamed),
+    })
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile; None for no values"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def summarize_llm_calls(calls: List[Dict]) -> List[Dict]:
+    """Per-function call counts, error rate, latency percentiles and token totals for the dashboard"""
+    by_function: Dict[str, List[Dict]] = {}
+    for call in calls:
+        by_function.setdefault(call['function'], []).append(call)
+
+    summary = []
+    for function, rows in sorted(by_function.items()):
+        # Cache hits would flatten the latency percentiles of real requests
+        requests = [row for row in rows if row['status'] != "cached"]
+        latencies = [row['latency_ms'] for row in requests if row['status'] == "ok"]
+        ttfts = [row['ttft_ms'] for row in requests if row['ttft_ms'] is not None]
+        errors = sum(1 for row in requests if row['status'] == "error")
+        summary.append({
+            'function': function,
+            'calls': len(rows),
+            'cached': len(rows) - len(requests),
+            'errors': errors,
+            'error_rate': round(errors / len(requests), 3) if requests else 0.0,
+            'retries': sum(row['retries'] or 0 for row in requests),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p95_ttft_ms': percentile(ttfts, 95),
+            'prompt_tokens': sum(row['prompt_tokens'] or 0 for row in requests),
+            'completion_tokens': sum(row['completion_tokens'] or 0 for row in requests),
+        })
+    return summary
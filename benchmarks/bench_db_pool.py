@@ -0,0 +1,88 @@
+"""
+Benchmark: pooled WAL connections vs. the legacy connect-per-call design.
+
+Simulates the database work of one Streamlit rerun (list sessions, list
+versions, load one version, read chat history) plus a chat message write, and
+reports the average time per rerun for both designs. Both run the same SQL
+statements (RERUN), so the difference is the connection handling alone.
+
+Usage:
+    python benchmarks/bench_db_pool.py [--reruns 500] [--versions 50]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from utils.database import PRDDatabase
+
+
+# The database work of one rerun; both designs run exactly these statements
+RERUN = [
+    ("SELECT session_id, product_name, created_at, updated_at FROM sessions ORDER BY updated_at DESC", False),
+    ("SELECT version_number, content FROM versions WHERE session_id = :session_id ORDER BY version_number DESC", False),
+    ("SELECT version_number, content FROM versions WHERE session_id = :session_id AND version_number = :version_number", False),
+    ("SELECT message_type, content FROM chat_messages WHERE session_id = :session_id ORDER BY created_at", False),
+    ("INSERT INTO chat_messages (session_id, message_type, content) VALUES (:session_id, 'user', 'ping')", True),
+]
+
+
+def legacy_rerun(db_path: str, params: dict):
+    """The old style: connect, execute, (commit), close for every statement"""
+    for sql, write in RERUN:
+        conn = sqlite3.connect(db_path)
+        conn.execute(sql, params).fetchall()
+        if write:
+            conn.commit()
+        conn.close()
+
+
+def pooled_rerun(db: PRDDatabase, params: dict):
+    for sql, write in RERUN:
+        if write:
+            with db.transaction() as conn:
+                conn.execute(sql, params)
+        else:
+            with db.connection() as conn:
+                conn.execute(sql, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=500)
+    parser.add_argument("--versions", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db = PRDDatabase(db_path)
+        session_id = str(uuid.uuid4())
+        db.create_session(session_id, "Benchmark Product")
+        for i in range(args.versions):
+            db.save_version(session_id, f"# PRD\n\nRevision {i}\n" * 50, "Bench", f"Change {i}", f"Request {i}")
+
+        start = time.perf_counter()
+        for i in range(args.reruns):
+            legacy_rerun(db_path, {"session_id": session_id, "version_number": i % args.versions + 1})
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(args.reruns):
+            pooled_rerun(db, {"session_id": session_id, "version_number": i % args.versions + 1})
+        pooled = time.perf_counter() - start
+        db.close()
+
+    print(f"Reruns: {args.reruns}, versions in session: {args.versions}")
+    print(f"connect-per-call: {legacy / args.reruns * 1000:.3f} ms/rerun")
+    print(f"pooled WAL:       {pooled / args.reruns * 1000:.3f} ms/rerun")
+    print(f"speedup:          {legacy / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark: cold import time of the app's utility modules.
+
+Runs a fresh interpreter with `python -X importtime` for each repetition,
+importing the modules the Streamlit app loads on startup, and reports the
+median cumulative import time and the slowest imports. It also guards the lazy
+loading: heavy optional libraries (openai, PyMuPDF, docx2txt) must not be
+imported just by importing the app modules, and the total can be capped with
+--max-ms. Exits with status 1 if a guard is violated.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 5] [--max-ms 150] [--top 10]
+"""
+
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def app_modules() -> list:
+    """The utils modules app.py loads on startup: its module-level imports and, recursively, theirs.
+
+    Read from the source, so a module the app starts importing is measured and
+    guarded without editing a list here. streamlit and dotenv themselves are
+    not ours to optimize; imports inside functions are lazy by design.
+    """
+    modules = []
+    pending = [os.path.join(APP_DIR, "app.py")]
+    while pending:
+        path = pending.pop(0)
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        in_utils = os.path.dirname(path).endswith("utils")
+        for node in tree.body:
+            if not isinstance(node, ast.ImportFrom) or not node.module:
+                continue
+            if node.level == 0 and node.module.startswith("utils."):
+                name = node.module
+            elif node.level == 1 and in_utils:
+                name = "utils." + node.module
+            else:
+                continue
+            if name not in modules:
+                modules.append(name)
+                pending.append(os.path.join(APP_DIR, *name.split(".")) + ".py")
+    return modules
+
+
+APP_MODULES = app_modules()
+
+# Libraries that must only be loaded on first use
+LAZY_MODULES = ["openai", "fitz", "docx2txt"]
+
+
+def import_profile() -> list:
+    """Import APP_MODULES in a fresh interpreter; returns (module, self_us, cumulative_us, depth) rows"""
+    env = dict(os.environ)
+    # Import must not depend on configuration
+    env.pop("OPENAI_API_KEY", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(APP_MODULES)],
+        cwd=APP_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing the app modules failed:\n{result.stderr}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting is shown as two spaces per level after the separator's own space
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the app modules")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median total exceeds this")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    args = parser.parse_args()
+
+    totals = []
+    profile = []
+    for _ in range(args.runs):
+        profile = import_profile()
+        # Top-level rows of our own modules add up to the whole import (interpreter startup excluded)
+        totals.append(sum(
+            cumulative for name, _, cumulative, depth in profile if depth == 0 and name in APP_MODULES
+        ) / 1000)
+
+    median_ms = statistics.median(totals)
+    print(f"Cold import of {len(APP_MODULES)} app modules, {args.runs} runs")
+    print(f"  median: {median_ms:.1f} ms   min: {min(totals):.1f} ms   max: {max(totals):.1f} ms")
+    print("\nSlowest imports (last run, cumulative):")
+    for name, _, cumulative, _ in sorted(profile, key=lambda row: row[2], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    loaded = {name for name, _, _, _ in profile}
+    eager = [module for module in LAZY_MODULES if module in loaded]
+    if eager:
+        print(f"\nFAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"\nFAIL: median {median_ms:.1f} ms exceeds --max-ms {args.max_ms}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Load test: the PRD chat flow end to end against the offline stub provider.
+
+Each simulated user creates a session, streams an initial PRD, then sends
+update requests that go through the same steps as the Streamlit app: section
+edits (falling back to a streamed rewrite), local change summary, commit_turn
+and the side-by-side diff of the preview. No network access is needed; the
+stub's latency, token rate and error rate are set from the command line.
+Reports per-step latency percentiles and overall throughput.
+
+Usage:
+    python benchmarks/bench_stub_flow.py [--users 8] [--updates 5] [--latency-ms 200]
+        [--tokens-per-second 200] [--error-rate 0.0]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the PRD flow with the stub LLM provider")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--updates", type=int, default=5, help="update requests per user")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["LLM_STUB_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["LLM_STUB_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["LLM_STUB_ERROR_RATE"] = str(args.error_rate)
+
+    from utils.database import PRDDatabase
+    from utils.diff_utils import generate_side_by_side_diff, summarize_changes
+    from utils.llm_scheduler import LLMError
+    from utils.llm_utils import stream_initial_prd, stream_interactive_prd_update, generate_prd_edits
+    from utils.markdown_utils import apply_prd_edits
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_stub_flow.db")
+    db = PRDDatabase(db_path, pool_size=args.users)
+    timings = {"initial": [], "update": [], "commit": [], "diff": []}
+    failures = []
+    lock = threading.Lock()
+
+    def record(step: str, started: float):
+        with lock:
+            timings[step].append(time.perf_counter() - started)
+
+    def user(index: int):
+        session_id = str(uuid.uuid4())
+        product = f"Product {index}"
+        db.create_session(session_id, product)
+        try:
+            started = time.perf_counter()
+            prd = "".join(stream_initial_prd(f"MRD for product {index}", product)).strip()
+            record("initial", started)
+            db.save_version(session_id, prd, "Initial PRD", "Generated initial PRD", f"Product: {product}")
+
+            for turn in range(args.updates):
+                request = f"Request {turn} of user {index}"
+                started = time.perf_counter()
+                try:
+                    updated = apply_prd_edits(prd, generate_prd_edits(prd, request, product) or [])
+                except ValueError:
+                    updated = "".join(stream_interactive_prd_update(prd, request, product)).strip()
+                record("update", started)
+
+                started = time.perf_counter()
+                summary = summarize_changes(prd, updated)
+                db.commit_turn(session_id, request, updated, summary, f"Updated: {summary}")
+                record("commit", started)
+
+                started = time.perf_counter()
+                generate_side_by_side_diff(prd, updated)
+                record("diff", started)
+                prd = updated
+        except LLMError as e:
+            with lock:
+                failures.append(e.kind)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    db.close()
+
+    turns = len(timings["commit"])
+    print(f"{args.users} users x {args.updates} updates, stub latency {args.latency_ms:.0f} ms, "
+          f"{args.tokens_per_second:.0f} tokens/s, error rate {args.error_rate}")
+    print(f"{'step':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for step, values in timings.items():
+        if values:
+            print(f"{step:<10}{len(values):>6}{statistics.median(values) * 1000:>10.1f}"
+                  f"{percentile(values, 95) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    print(f"\n{turns} turns in {elapsed:.2f} s ({turns / elapsed:.1f} turns/s), {len(failures)} users failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Stress test: concurrent PRDDatabase.commit_turn() writers on one session.
+
+Several worker processes (standing in for app replicas), each with several
+threads (standing in for browser tabs), commit turns to the same session at
+once. Afterwards the script checks that version numbers are exactly
+1..N with no duplicates or gaps and that every version owns exactly one user
+and one assistant message, with no orphaned messages. Exits non-zero on
+any violation.
+
+Usage:
+    python benchmarks/stress_commit_turn.py [--processes 4] [--threads 4] [--turns 25]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from utils.database import PRDDatabase
+
+SESSION_ID = "stress-session"
+
+
+def run_worker(db_path: str, worker: int, threads: int, turns: int):
+    """One replica: its own PRDDatabase (and pool) shared by several writer threads"""
+    db = PRDDatabase(db_path, pool_size=threads)
+
+    def writer(thread: int):
+        for turn in range(turns):
+            tag = f"w{worker}-t{thread}-{turn}"
+            db.commit_turn(SESSION_ID, f"request {tag}", f"# PRD\n\n{tag}\n", f"summary {tag}", f"reply {tag}")
+
+    workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    db.close()
+
+
+def check(db: PRDDatabase, expected: int) -> list:
+    """Return a list of invariant violations"""
+    errors = []
+    with db.connection() as conn:
+        numbers = [row[0] for row in conn.execute(
+            "SELECT version_number FROM versions WHERE session_id = ? ORDER BY version_number", (SESSION_ID,)
+        )]
+        if numbers != list(range(1, expected + 1)):
+            errors.append(f"version numbers are not 1..{expected}: got {len(numbers)} rows, {len(set(numbers))} distinct")
+
+        bad_turns = conn.execute('''
+            SELECT v.version_number,
+                   SUM(m.message_type = 'user'), SUM(m.message_type = 'assistant')
+            FROM versions v LEFT JOIN chat_messages m ON m.version_id = v.id
+            WHERE v.session_id = ?
+            GROUP BY v.id
+            HAVING SUM(m.message_type = 'user') IS NOT 1 OR SUM(m.message_type = 'assistant') IS NOT 1
+        ''', (SESSION_ID,)).fetchall()
+        if bad_turns:
+            errors.append(f"{len(bad_turns)} versions without exactly one user and one assistant message")
+
+        orphans = conn.execute(
+            "SELECT COUNT(*) FROM chat_messages WHERE session_id = ? AND version_id IS NULL", (SESSION_ID,)
+        ).fetchone()[0]
+        if orphans:
+            errors.append(f"{orphans} orphaned chat messages")
+
+        # Each version's content must match the turn its messages belong to
+        mismatched = conn.execute('''
+            SELECT COUNT(*) FROM versions v JOIN chat_messages m ON m.version_id = v.id
+            WHERE v.session_id = ? AND m.message_type = 'user' AND v.user_prompt != m.content
+        ''', (SESSION_ID,)).fetchone()[0]
+        if mismatched:
+            errors.append(f"{mismatched} versions linked to another turn's message")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stress.db")
+        db = PRDDatabase(db_path)
+        db.create_session(SESSION_ID, "Stress Product")
+
+        start = time.perf_counter()
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(db_path, i, args.threads, args.turns))
+            for i in range(args.processes)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        expected = args.processes * args.threads * args.turns
+        failed_workers = [p.exitcode for p in processes if p.exitcode != 0]
+        errors = check(db, expected)
+        if failed_workers:
+            errors.append(f"{len(failed_workers)} worker processes failed")
+        db.close()
+
+    print(f"{expected} turns from {args.processes} processes x {args.threads} threads in {elapsed:.2f}s "
+          f"({expected / elapsed:.0f} turns/s)")
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        sys.exit(1)
+    print("✅ No duplicate version numbers or orphaned messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from utils.diff_utils import summarize_changes
+
+PRD = """# Doc
+
+Intro text.
+
+## 1. Overview
+
+Overview body.
+
+## 2. Scope
+
+Scope body
+more scope.
+
+## 3. Risk Assessment
+
+Risk body.
+"""
+
+OVERVIEW = """## 1. Overview
+
+Overview body.
+
+"""
+
+SCOPE = """## 2. Scope
+
+Scope body
+more scope.
+
+"""
+
+
+def test_deleting_a_section_reports_only_that_section():
+    assert summarize_changes(PRD, PRD.replace(OVERVIEW, "")) == "Removed: Overview"
+    assert summarize_changes(PRD, PRD.replace(SCOPE, "")) == "Removed: Scope"
+
+
+def test_inserting_a_section_reports_only_that_section():
+    assert summarize_changes(PRD.replace(OVERVIEW, ""), PRD) == "Added: Overview"
+    assert summarize_changes(PRD.replace(SCOPE, ""), PRD) == "Added: Scope"
+
+
+def test_edit_inside_a_section_is_counted_there():
+    assert summarize_changes(PRD, PRD.replace("Scope body", "Scope body, revised")) == "Modified: Scope (+1/−1)"